@@ -1,45 +1,104 @@
 import os
-from typing import Dict, List, Any, Optional
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Any, Optional, Tuple, TypedDict
 from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from typing import TypedDict, List, Optional, Union
-import copy
 
 from tools.retriever_tool import DocumentRetriever
 from tools.search_tool import WebSearchTool
 from tools.pdf_tool import PDFProcessor
+from conversation_memory import ConversationMemory, Turn, extractive_summary
+from thread_store import ThreadStore
+from context_packer import ContextItem, format_packed, pack_context
+from ingestion_queue import IngestionJob, IngestionQueue
+from tools.instrumentation import Instrumentation, instrumentation as default_instrumentation
+from tools.embedding_registry import embedding_registry
 
 class AgentState(TypedDict):
     """State schema for the agent."""
-    messages: List[Union[HumanMessage, AIMessage]]
+    thread_id: str
     query: str
-    csv_results: Optional[str]
-    web_results: Optional[str]
-    pdf_results: Optional[str]
+    csv_results: Optional[List[ContextItem]]
+    web_results: Optional[List[ContextItem]]
+    pdf_results: Optional[List[ContextItem]]
+    route: Optional[List[str]]
     response: Optional[str]
 
+SEARCH_NODES = ["document_search", "web_search", "pdf_search"]
+
+# Keyword cues for the local router. A query that matches any cue is routed
+# without asking the LLM; the transcripts are searched unless the query only
+# asks for information they cannot hold (WEB_ONLY_CUES).
+DOCUMENT_CUES = re.compile(
+    r"\b(transcripts?|samples?|patients?|case|operative|procedure (?:note|report)|"
+    r"pre-?operative|post-?operative|diagnos[ie]s|findings|indications?|anesthesia|"
+    r"specimens?|in the (?:document|record|report|note))\b",
+    re.IGNORECASE,
+)
+WEB_ONLY_CUES = re.compile(
+    r"\b(latest|recent|news|costs?|price|guidelines?|statistics|prevalence|incidence|"
+    r"success rates?|complications? rates?|fda)\b",
+    re.IGNORECASE,
+)
+# General-knowledge phrasing: adds web search, but the transcripts may hold the answer too
+WEB_CUES = re.compile(
+    r"\b(recovery (?:time|period)|how long|side effects?|risks?|what is|what are|define|"
+    r"definition|symptoms?|treatment options?|average|typical(?:ly)?|usual(?:ly)?)\b",
+    re.IGNORECASE,
+)
+PDF_CUES = re.compile(
+    r"\b(pdf|protocol|uploaded|attached|trial|study|paper|inclusion|exclusion|"
+    r"endpoints?|arms?|dosing|eligibility)\b",
+    re.IGNORECASE,
+)
+
 class MedTranscriptAgent:
-    def __init__(self, anthropic_api_key: Optional[str] = None, debug: bool = False):
+    def __init__(self, anthropic_api_key: Optional[str] = None, debug: bool = False, routing_mode: str = "auto",
+                 max_workers: int = 8, thread_store: Optional[ThreadStore] = None, context_budget_tokens: int = 3000,
+                 llm: Optional[BaseChatModel] = None, doc_retriever: Optional[DocumentRetriever] = None,
+                 web_search: Optional[WebSearchTool] = None, pdf_processor: Optional[PDFProcessor] = None,
+                 instrumentation: Optional[Instrumentation] = None, embedding_model: Optional[str] = None,
+                 embedding_backend: str = "torch"):
+        if routing_mode not in ("llm", "local", "auto"):
+            raise ValueError(f"Unknown routing mode: {routing_mode}")
+        # Components left as None get their production defaults; injecting a fake chat model
+        # and an offline search provider makes turns deterministic (see benchmarks/)
         self.api_key = anthropic_api_key or os.getenv("ANTHROPIC_API_KEY")
-        if not self.api_key:
+        if llm is None and not self.api_key:
             raise ValueError("Anthropic API key is required")
         
-        self.llm = ChatAnthropic(
+        self.llm = llm or ChatAnthropic(
             model="claude-3-7-sonnet-20250219",
             anthropic_api_key=self.api_key,
             temperature=0.1
         )
         
-        self.doc_retriever = DocumentRetriever()
-        self.web_search = WebSearchTool(debug=debug)
-        self.pdf_processor = PDFProcessor()
+        # Embedding models load on first use; embedding_model puts both sources on one shared model,
+        # embedding_backend runs them on PyTorch, ONNX or int8-quantized ONNX
+        model_kwargs = {"embedding_backend": embedding_backend}
+        if embedding_model:
+            model_kwargs["model_name"] = embedding_model
+        self.doc_retriever = doc_retriever or DocumentRetriever(**model_kwargs)
+        self.web_search = web_search or WebSearchTool(debug=debug)
+        self.pdf_processor = pdf_processor or PDFProcessor(**model_kwargs)
         self.debug = debug
-        
-        self.memory_store = MemorySaver()
-        
-        self.conversation_threads = {}
+        self.routing_mode = routing_mode
+        self.instrumentation = instrumentation or default_instrumentation
+        self.instrumentation.register_collector(self._collect_metrics)
+        # Shared token budget for retrieved passages from all sources in the answer prompt
+        self.context_budget_tokens = context_budget_tokens
+        # CPU-bound retrieval (embedding + FAISS) runs here on the async path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-tools")
+        # PDF uploads and document additions are parsed and embedded here, off the request path
+        self.ingestion = IngestionQueue(max_workers=1)
+        
+        # Conversation state lives only in the thread store; graph state is per turn,
+        # so no checkpointer is needed and any worker sharing the store can serve a thread.
+        self.memory = ConversationMemory(summarizer=self._summarize_turns, store=thread_store)
         
         self.graph = self._build_graph()
     
@@ -48,33 +107,116 @@ class MedTranscriptAgent:
         
         workflow = StateGraph(AgentState)
         
-        workflow.add_node("query_router", self._route_query)
-        workflow.add_node("document_search", self._perform_doc_search)
-        workflow.add_node("web_search", self._perform_web_search)
-        workflow.add_node("pdf_search", self._perform_pdf_search)
-        workflow.add_node("combine_results", self._generate_response)
+        # Each node has a sync implementation for invoke() and an async one for ainvoke(),
+        # both timed by the instrumentation
+        def node(name, func, afunc):
+            return RunnableLambda(self.instrumentation.wrap_node(name, func),
+                                  afunc=self.instrumentation.wrap_async_node(name, afunc))
+        
+        workflow.add_node("query_router", node("query_router", self._route_query, self._aroute_query))
+        workflow.add_node("document_search", node("document_search", self._perform_doc_search, self._aperform_doc_search))
+        workflow.add_node("web_search", node("web_search", self._perform_web_search, self._aperform_web_search))
+        workflow.add_node("pdf_search", node("pdf_search", self._perform_pdf_search, self._aperform_pdf_search))
+        workflow.add_node("combine_results", node("combine_results", self._generate_response, self._agenerate_response))
         
         workflow.add_edge(START, "query_router")
-        workflow.add_edge("query_router", "document_search")
-        workflow.add_edge("query_router", "web_search")
-        workflow.add_edge("query_router", "pdf_search")
+        workflow.add_conditional_edges("query_router", self._select_search_nodes, SEARCH_NODES)
         workflow.add_edge("document_search", "combine_results")
         workflow.add_edge("web_search", "combine_results")
         workflow.add_edge("pdf_search", "combine_results")
         workflow.add_edge("combine_results", END)
         
-        return workflow.compile(checkpointer=self.memory_store)
+        return workflow.compile()
+    
+    def _select_search_nodes(self, state: AgentState) -> List[str]:
+        """Conditional edge: fan out only to the search nodes chosen by the router"""
+        return state.get("route") or list(SEARCH_NODES)
     
     def _route_query(self, state: AgentState) -> Dict[str, Any]:
         """Determine which tool(s) to use for the query"""
         
         query = state["query"]
-        messages = state.get("messages", [])
+        thread_id = state["thread_id"]
         
         if self.debug:
-            print(f"[Router] Processing query with {len(messages)} existing messages")
+            print(f"[Router] Processing query with {self.memory.message_count(thread_id)} existing messages")
+        
+        next_steps = self._route_without_llm(query, thread_id)
+        if next_steps is None:
+            next_steps = self._route_with_llm(query, thread_id)
         
-        conversation_history = self._format_conversation_history(messages)
+        return self._route_update(next_steps)
+    
+    async def _aroute_query(self, state: AgentState) -> Dict[str, Any]:
+        """Async version of _route_query"""
+        query = state["query"]
+        thread_id = state["thread_id"]
+        
+        next_steps = self._route_without_llm(query, thread_id)
+        if next_steps is None:
+            prompt = self._routing_prompt(query, thread_id)
+            response = await self.llm.ainvoke(prompt)
+            self.instrumentation.record_llm("query_router", prompt, response)
+            next_steps = self._parse_route(response.content)
+        
+        return self._route_update(next_steps)
+    
+    def _route_without_llm(self, query: str, thread_id: str) -> Optional[List[str]]:
+        """Local routing decision, None when the LLM has to be asked"""
+        if self.routing_mode == "llm":
+            return None
+        next_steps = self._route_locally(query, has_history=self.memory.has_history(thread_id))
+        if next_steps is None and self.routing_mode == "local":
+            next_steps = ["document_search", "web_search"]
+        return next_steps
+    
+    def _route_update(self, next_steps: List[str]) -> Dict[str, Any]:
+        """State update for the routing decision"""
+        if not self.pdf_processor.pdf_docs and "pdf_search" in next_steps:
+            next_steps.remove("pdf_search")
+            if not next_steps:
+                next_steps = ["document_search", "web_search"]
+        
+        if self.debug:
+            print(f"[Router] Selected nodes: {next_steps}")
+        
+        return {"route": next_steps}
+    
+    def _route_locally(self, query: str, has_history: bool = False) -> Optional[List[str]]:
+        """Keyword router for obvious queries, returns None when the LLM should decide"""
+        if has_history and len(query.split()) < 6:
+            # Short follow-ups ("what about this one?") depend on context
+            return None
+        
+        document = bool(DOCUMENT_CUES.search(query))
+        web_only = bool(WEB_ONLY_CUES.search(query))
+        web = web_only or bool(WEB_CUES.search(query))
+        pdf = bool(PDF_CUES.search(query)) and bool(self.pdf_processor.pdf_docs)
+        if not (document or web or pdf):
+            return None
+        
+        next_steps = []
+        # Skipping the transcripts is only safe when the query clearly asks for outside information
+        if document or not web_only:
+            next_steps.append("document_search")
+        if web:
+            next_steps.append("web_search")
+        if pdf:
+            next_steps.append("pdf_search")
+        
+        if self.debug:
+            print(f"[Router] Local decision: {next_steps}")
+        return next_steps
+    
+    def _route_with_llm(self, query: str, thread_id: str) -> List[str]:
+        """Ask the LLM which sources to search"""
+        prompt = self._routing_prompt(query, thread_id)
+        response = self.llm.invoke(prompt)
+        self.instrumentation.record_llm("query_router", prompt, response)
+        return self._parse_route(response.content)
+    
+    def _routing_prompt(self, query: str, thread_id: str) -> str:
+        conversation_history = self.memory.router_view(thread_id)
         
         routing_prompt = f"""
         You are a medical query router. Your job is to determine whether a query about medical topics should be:
@@ -91,8 +233,10 @@ class MedTranscriptAgent:
         
         Respond with one or more of: "document", "web", "pdf"
         """
-        
-        route = self.llm.invoke(routing_prompt).content.strip().lower()
+        return routing_prompt
+    
+    def _parse_route(self, route: str) -> List[str]:
+        route = route.strip().lower()
         
         if self.debug:
             print(f"[Router] Decision: {route}")
@@ -106,50 +250,115 @@ class MedTranscriptAgent:
             next_steps.append("pdf_search")
         
         if not next_steps:  
-            next_steps = ["document_search", "web_search", "pdf_search"]
+            next_steps = list(SEARCH_NODES)
             
-        return {"next": next_steps}
+        return next_steps
     
     def _perform_doc_search(self, state: AgentState) -> Dict[str, Any]:
-        """Perform document search and return results"""
+        """Perform document search and return one context item per matching passage"""
         query = state["query"]
         if self.debug:
             print(f"[Document Search] Searching for: {query}")
-        results = self.doc_retriever.query(query)
+        try:
+            items = []
+            for hit in self.doc_retriever.query_batch([query])[0]:
+                meta = hit.metadata
+                for section, text, score in self.doc_retriever.hit_passages(hit):
+                    label = (f"[Document {hit.rank+1}] (Score: {score:.2f}) "
+                             f"Specialty: {meta.get('medical_specialty', 'Unknown')} | "
+                             f"Sample: {meta.get('sample_name', 'Unknown')}")
+                    if section:
+                        label += f" | Section: {section}"
+                    items.append(ContextItem("document", label, text, score))
+        except Exception as e:
+            items = [ContextItem("document", "", f"Error during retrieval: {str(e)}")]
         
-        return {"csv_results": results}
+        return {"csv_results": items}
     
     def _perform_web_search(self, state: AgentState) -> Dict[str, Any]:
-        """Perform web search and return results"""
+        """Perform web search and return one context item per result"""
         query = state["query"]
         if self.debug:
             print(f"[Web Search] Searching for: {query}")
-        results = self.web_search.search(query)
+        try:
+            results = self.web_search.search_results(query)
+            # Providers return results best first; the score only preserves that order when packing
+            items = [
+                ContextItem("web", f"Title: {r.get('title', 'No title')}\nSource: {r.get('href', 'No source')}",
+                            r.get("body", ""), -rank)
+                for rank, r in enumerate(results)
+            ]
+        except Exception as e:
+            items = [ContextItem("web", "", f"Search error: {str(e)}")]
         
-        return {"web_results": results}
+        return {"web_results": items}
     
     def _perform_pdf_search(self, state: AgentState) -> Dict[str, Any]:
-        """Perform PDF search and return results"""
+        """Perform PDF search and return one context item per chunk"""
         query = state["query"]
         if self.debug:
             print(f"[PDF Search] Searching for: {query}")
-        results = self.pdf_processor.search(query)
+        try:
+            items = [
+                ContextItem("pdf", f"[PDF-{i+1}] {hit.source} (Score: {hit.score:.2f})", hit.text, hit.score)
+                for i, hit in enumerate(self.pdf_processor.search_hits(query))
+            ]
+        except Exception as e:
+            items = [ContextItem("pdf", "", f"PDF search error: {str(e)}")]
         
-        return {"pdf_results": results}
+        return {"pdf_results": items}
+    
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def _aperform_doc_search(self, state: AgentState) -> Dict[str, Any]:
+        """Async document search, the encode + FAISS work runs in the executor"""
+        return await self._run_in_executor(self._perform_doc_search, state)
+    
+    async def _aperform_web_search(self, state: AgentState) -> Dict[str, Any]:
+        """Async web search, the blocking provider calls run in the executor"""
+        return await self._run_in_executor(self._perform_web_search, state)
+    
+    async def _aperform_pdf_search(self, state: AgentState) -> Dict[str, Any]:
+        """Async PDF search, the encode + FAISS work runs in the executor"""
+        return await self._run_in_executor(self._perform_pdf_search, state)
     
     def _generate_response(self, state: AgentState) -> Dict[str, Any]:
         """Generate a response based on search results and conversation history"""
+        prompt = self._response_prompt(state)
+        response = self.llm.invoke(prompt)
+        self.instrumentation.record_llm("combine_results", prompt, response)
+        return self._response_update(state, response.content)
+    
+    async def _agenerate_response(self, state: AgentState) -> Dict[str, Any]:
+        """Async version of _generate_response"""
+        prompt = self._response_prompt(state)
+        response = await self.llm.ainvoke(prompt)
+        self.instrumentation.record_llm("combine_results", prompt, response)
+        return self._response_update(state, response.content)
+    
+    def _response_prompt(self, state: AgentState) -> str:
         query = state["query"]
-        messages = state.get("messages", [])
+        thread_id = state["thread_id"]
         
         if self.debug:
-            print(f"[Generate Response] Processing with {len(messages)} messages in history")
+            print(f"[Generate Response] Processing with {self.memory.message_count(thread_id)} messages in history")
         
-        csv_results = state.get("csv_results", "No document results available")
-        web_results = state.get("web_results", "No web results available")
-        pdf_results = state.get("pdf_results", "No PDF results available")
+        # Sources share one budget, so a long transcript cannot crowd out the web and PDF results
+        searched = {key: state.get(key) for key in ("csv_results", "web_results", "pdf_results")}
+        packed = pack_context({key: items for key, items in searched.items() if items}, self.context_budget_tokens)
         
-        conversation_history = self._format_conversation_history(messages)
+        def render(key: str) -> str:
+            if searched[key] is None:
+                return "Not searched for this query"
+            return format_packed(packed.get(key) or []) or "No relevant results found"
+        
+        csv_results = render("csv_results")
+        web_results = render("web_results")
+        pdf_results = render("pdf_results")
+        
+        conversation_history = self.memory.response_view(thread_id)
         
         response_prompt = f"""
         You are a helpful medical assistant answering questions about medical transcripts and general medical knowledge.
@@ -170,74 +379,197 @@ class MedTranscriptAgent:
         Make sure to consider the conversation history for context and continuity.
         When citing information, clearly indicate the source (Document, Web, or PDF).
         """
-        
-        response = self.llm.invoke(response_prompt).content
-        
-        updated_messages = messages + [
-            HumanMessage(content=query),
-            AIMessage(content=response)
-        ]
-        
-        if self.debug:
-            print(f"[Generate Response] History now has {len(updated_messages)} messages")
-        
-        return {
-            "response": response,
-            "messages": updated_messages
+        return response_prompt
+    
+    def _response_update(self, state: AgentState, response: str) -> Dict[str, Any]:
+        return {"response": response}
+    
+    def _summarize_turns(self, previous_summary: str, turns: List[Turn]) -> str:
+        """Fold older turns into the rolling conversation summary"""
+        transcript = "\n\n".join(f"Human: {turn.user}\nAI: {turn.assistant}" for turn in turns)
+        summary_prompt = f"""
+        Update the running summary of a medical Q&A conversation with the new turns below.
+        Keep the patients, procedures, findings and open questions that later questions may refer to.
+        Reply with the updated summary only, in at most 150 words.
+        
+        Current summary: {previous_summary or "None"}
+        
+        New turns:
+        {transcript}
+        """
+        try:
+            response = self.llm.invoke(summary_prompt)
+            self.instrumentation.record_llm("summarize", summary_prompt, response)
+            return response.content.strip()
+        except Exception as e:
+            if self.debug:
+                print(f"[Memory] Summarization failed, using extractive summary: {e}")
+            return extractive_summary(previous_summary, turns)
+    
+    def _collect_metrics(self):
+        """Cache and ingestion gauges, read by the instrumentation at scrape time"""
+        caches = {
+            "retriever_embeddings": self.doc_retriever.embedding_cache,
+            "retriever_results": self.doc_retriever.result_cache,
+            "pdf_embeddings": self.pdf_processor.embedding_cache,
+            "pdf_results": self.pdf_processor.result_cache,
         }
+        for name, cache in caches.items():
+            yield "cache_hits_total", "counter", {"cache": name}, cache.hits
+            yield "cache_misses_total", "counter", {"cache": name}, cache.misses
+            yield "cache_entries", "gauge", {"cache": name}, len(cache)
+        yield "ingestion_jobs_pending", "gauge", {}, self.ingestion.pending_count()
+        yield "pdf_documents_loaded", "gauge", {}, len(self.pdf_processor.pdf_docs)
     
-    def _format_conversation_history(self, messages: List) -> str:
-        """Format conversation history for inclusion in prompts"""
-        if not messages:
-            return "No previous conversation"
-        
-        formatted = []
-        for i in range(0, len(messages), 2):
-            if i < len(messages):
-                user_msg = messages[i].content if i < len(messages) else ""
-                ai_msg = messages[i+1].content if i+1 < len(messages) else ""
-                formatted.append(f"Human: {user_msg}\nAI: {ai_msg}")
-        
-        return "\n\n".join(formatted)
+    def close(self):
+        """Finish queued ingestion and release the tools' document stores"""
+        self.ingestion.shutdown(wait=True)
+        self.doc_retriever.close()
+        self.pdf_processor.close()
+    
+    def warm_up(self, background: bool = True, pdf: bool = False):
+        """Load the transcript search model now instead of on the first query.
+
+        The PDF model is otherwise loaded by the first upload; pdf=True loads it too.
+        """
+        tools = (self.doc_retriever, self.pdf_processor) if pdf else (self.doc_retriever,)
+        models = [(tool.model_name, tool.embedding_backend) for tool in tools]
+        return embedding_registry.warm_up(models, background=background)
     
     def load_pdf(self, file_path: str) -> str:
         """Load a PDF document into the agent"""
         return self.pdf_processor.load_pdf(file_path)
     
-    def chat(self, message: str, thread_id: str = "default") -> str:
-        """Process a message in a conversation thread"""
-        if thread_id in self.conversation_threads:
-            messages = self.conversation_threads[thread_id]
-            if self.debug:
-                print(f"[Chat] Retrieved {len(messages)} messages for thread {thread_id}")
-        else:
-            messages = []
-            if self.debug:
+    def load_pdf_bytes(self, data: bytes, name: Optional[str] = None) -> str:
+        """Load an uploaded PDF from memory; unchanged content is served from the PDF cache"""
+        return self.pdf_processor.load_pdf_bytes(data, name=name)
+    
+    def submit_pdf(self, data: bytes, name: Optional[str] = None) -> IngestionJob:
+        """Queue an uploaded PDF for background ingestion, chats meanwhile answer from the sources already indexed"""
+        return self.ingestion.submit("pdf", name or "uploaded PDF", self.pdf_processor.load_pdf_bytes, data, name=name)
+    
+    def submit_documents(self, texts: List[str], metadata: Optional[List[Dict[str, Any]]] = None) -> IngestionJob:
+        """Queue transcripts for background addition to the document index"""
+        return self.ingestion.submit("documents", f"{len(texts)} transcripts", self.doc_retriever.add_documents,
+                                     texts, metadata)
+    
+    def ingestion_status(self, job_id: str) -> Optional[IngestionJob]:
+        return self.ingestion.status(job_id)
+    
+    def _initial_state(self, message: str, thread_id: str) -> Dict[str, Any]:
+        if self.debug:
+            if self.memory.has_history(thread_id):
+                print(f"[Chat] Retrieved {self.memory.message_count(thread_id)} messages for thread {thread_id}")
+            else:
                 print(f"[Chat] Started new conversation thread {thread_id}")
         
-        state = {
+        return {
+            "thread_id": thread_id,
             "query": message,
-            "messages": copy.deepcopy(messages)  
         }
+    
+    def _finish_turn(self, thread_id: str, result: Dict[str, Any]) -> str:
+        response = result["response"]
+        self.memory.append(thread_id, result["query"], response)
+        
+        if self.memory.needs_compaction(thread_id):
+            # Summarizing takes an LLM call; do it off the request path
+            self._executor.submit(self.memory.compact, thread_id)
         
         if self.debug:
-            print(f"[Chat] Processing query with initial state containing {len(state['messages'])} messages")
+            print(f"[Chat] Updated thread {thread_id} with {self.memory.message_count(thread_id)} messages")
+        
+        return response
+    
+    def chat(self, message: str, thread_id: str = "default") -> str:
+        """Process a message in a conversation thread"""
+        state = self._initial_state(message, thread_id)
         
         try:
             result = self.graph.invoke(
                 state, 
                 config={"configurable": {"thread_id": thread_id}}
             )
-            
-            updated_messages = result.get("messages", [])
-            
-            self.conversation_threads[thread_id] = copy.deepcopy(updated_messages)
-            
-            if self.debug:
-                print(f"[Chat] Updated thread {thread_id} with {len(updated_messages)} messages")
-            
-            return result["response"]
+            return self._finish_turn(thread_id, result)
+        except Exception as e:
+            error_msg = f"Error processing message: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            return error_msg
+    
+    async def achat(self, message: str, thread_id: str = "default") -> str:
+        """Async version of chat: LLM calls are awaited and the selected searches run concurrently"""
+        state = self._initial_state(message, thread_id)
+        
+        try:
+            result = await self.graph.ainvoke(
+                state, 
+                config={"configurable": {"thread_id": thread_id}}
+            )
+            return self._finish_turn(thread_id, result)
+        except Exception as e:
+            error_msg = f"Error processing message: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            return error_msg
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Text of a streamed message chunk (Anthropic chunks may carry a list of content blocks)"""
+        content = getattr(chunk, "content", "")
+        if isinstance(content, str):
+            return content
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    
+    def stream_chat(self, message: str, thread_id: str = "default") -> Iterator[Tuple[str, str]]:
+        """Process a message and stream the answer.
+        
+        Yields ("token", text) for every token of the final answer as it is
+        generated, then a single ("done", response) once the turn is stored.
+        """
+        state = self._initial_state(message, thread_id)
+        result = None
+        
+        try:
+            for mode, payload in self.graph.stream(
+                state,
+                config={"configurable": {"thread_id": thread_id}},
+                stream_mode=["messages", "values"]
+            ):
+                if mode == "values":
+                    result = payload
+                    continue
+                chunk, metadata = payload
+                # Only the answer is streamed, not the router's LLM call
+                if metadata.get("langgraph_node") == "combine_results":
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield "token", text
+            yield "done", self._finish_turn(thread_id, result)
+        except Exception as e:
+            error_msg = f"Error processing message: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            yield "done", error_msg
+    
+    async def astream_chat(self, message: str, thread_id: str = "default") -> AsyncIterator[Tuple[str, str]]:
+        """Async version of stream_chat"""
+        state = self._initial_state(message, thread_id)
+        result = None
+        
+        try:
+            async for mode, payload in self.graph.astream(
+                state,
+                config={"configurable": {"thread_id": thread_id}},
+                stream_mode=["messages", "values"]
+            ):
+                if mode == "values":
+                    result = payload
+                    continue
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "combine_results":
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield "token", text
+            yield "done", self._finish_turn(thread_id, result)
         except Exception as e:
             error_msg = f"Error processing message: {str(e)}"
             print(f"[ERROR] {error_msg}")
-            return error_msg
\ No newline at end of file
+            yield "done", error_msg
@@ -1,8 +1,9 @@
 import os
-import gradio as gr
-import tempfile
-import json
-from agent import MedTranscriptAgent
+import time
+import asyncio
+from tools.instrumentation import instrumentation
+from thread_store import InMemoryThreadStore, SQLiteThreadStore
+from startup import AgentLoader
 from dotenv import load_dotenv
 import logging
 
@@ -22,35 +23,91 @@ if not os.getenv("ANTHROPIC_API_KEY"):
     logger.error("ANTHROPIC_API_KEY not found in environment variables or .env file")
     raise ValueError("ANTHROPIC_API_KEY is required. Please add it to your .env file.")
 
-agent = MedTranscriptAgent(debug=True)
+# Point every worker at the same THREAD_DB_PATH so any of them can serve any conversation
+thread_db_path = os.getenv("THREAD_DB_PATH")
+thread_store = SQLiteThreadStore(thread_db_path) if thread_db_path else InMemoryThreadStore()
+
+# SPAN_LOG_PATH writes one JSON line per span and LLM call
+span_log_path = os.getenv("SPAN_LOG_PATH")
+if span_log_path:
+    instrumentation.set_json_log(span_log_path)
+
+def build_agent():
+    """Import and build the agent, then load its transcript search model (runs on the loader thread)"""
+    from agent import MedTranscriptAgent
+    # EMBEDDING_MODEL runs document and PDF search on one shared model instead of two,
+    # EMBEDDING_BACKEND=onnx-int8 runs it as a quantized ONNX graph
+    new_agent = MedTranscriptAgent(debug=True, thread_store=thread_store, embedding_model=os.getenv("EMBEDDING_MODEL"),
+                                   embedding_backend=os.getenv("EMBEDDING_BACKEND", "torch"))
+    new_agent.warm_up(background=False)
+    if os.getenv("WARM_PDF_MODEL") == "1":
+        # Loads while the app already reports ready, the first upload then skips the load
+        new_agent.warm_up(background=True, pdf=True)
+    return new_agent
+
+# The agent, its index and models load in the background. With METRICS_PORT set, /health answers
+# right away and /ready (plus /metrics) turns 200 once the agent can serve questions;
+# METRICS_HOST=0.0.0.0 exposes them beyond localhost, e.g. to cluster probes
+agent_loader = AgentLoader(build_agent).start()
+instrumentation.register_collector(agent_loader.collect_metrics)
+metrics_port = os.getenv("METRICS_PORT")
+if metrics_port:
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    try:
+        instrumentation.serve(int(metrics_port), host=metrics_host, routes=agent_loader.routes())
+        logger.info(f"Serving /health, /ready and /metrics on {metrics_host}:{metrics_port}")
+    except OSError as e:
+        # e.g. another worker on this node already serves the port; the UI still starts
+        logger.warning(f"Could not serve metrics on {metrics_host}:{metrics_port}: {e}")
+
+# gradio is only imported once the health endpoint is up
+start = time.perf_counter()
+import gradio as gr
+logger.info(f"Imported gradio in {time.perf_counter() - start:.2f}s")
+
+# Seconds a question waits for an agent that is still starting before it is turned away
+AGENT_WAIT_SECONDS = float(os.getenv("AGENT_WAIT_SECONDS", "30"))
 
-conversation_threads = {}
+def get_agent(timeout=AGENT_WAIT_SECONDS):
+    """The agent once it is ready; raises with the startup state if it is not ready in time"""
+    agent = agent_loader.wait(timeout)
+    if agent is None:
+        status = agent_loader.status()
+        if status["state"] == "failed":
+            raise RuntimeError(f"The assistant failed to start: {status['error']}")
+        raise RuntimeError(f"The assistant is still starting ({status['phase']}, "
+                           f"{status['elapsed_seconds']:.0f}s), please try again shortly")
+    return agent
 
-def process_message(message, conversation_id=None, pdf_file=None):
+def prepare_conversation(conversation_id=None, pdf_file=None):
+    """Create a conversation ID if needed and queue an uploaded PDF for ingestion.
+
+    Returns the conversation ID and the ingestion job (None without a PDF).
+    The PDF is parsed and embedded in the background; until it is indexed,
+    questions are answered from the other sources.
+    """
     if not conversation_id:
         import uuid
         conversation_id = str(uuid.uuid4())
-        conversation_threads[conversation_id] = True
         logger.info(f"Created new conversation with ID: {conversation_id}")
     
+    job = None
     if pdf_file is not None:
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, "uploaded.pdf")
-        
-        with open(temp_path, "wb") as f:
-            f.write(pdf_file)
-        
-        pdf_id = agent.load_pdf(temp_path)
-        logger.info(f"Loaded PDF '{pdf_id}' for conversation {conversation_id}")
+        # Keyed by content hash: re-sent uploads are no-ops and known PDFs load from the cache
+        job = get_agent().submit_pdf(pdf_file)
+        logger.info(f"Queued PDF ingestion job {job.job_id} for conversation {conversation_id}")
     
-    logger.info(f"Processing message for conversation {conversation_id}: {message}")
-    response = agent.chat(message, thread_id=conversation_id)
-    
-    if hasattr(agent, "conversation_threads") and conversation_id in agent.conversation_threads:
-        thread_msgs = agent.conversation_threads[conversation_id]
-        logger.info(f"Thread {conversation_id} now has {len(thread_msgs)} messages")
-    
-    return response, conversation_id
+    return conversation_id, job
+
+def describe_job(job):
+    if job is None:
+        return "No"
+    job = get_agent().ingestion_status(job.job_id) or job
+    if job.status == "failed":
+        return f"Ingestion failed: {job.error}"
+    if job.status == "done":
+        return "Indexed"
+    return f"Ingesting ({job.status}, {job.progress:.0%}) {job.message}".rstrip()
 
 with gr.Blocks(title="Medical Transcript Q&A System") as demo:
     gr.Markdown("# Medical Transcript Q&A System")
@@ -101,35 +158,49 @@ with gr.Blocks(title="Medical Transcript Q&A System") as demo:
         
         return "", history, conv_id, pdf
     
-    def bot(history, conv_id, pdf):
-        """Process user message and add bot response to chat history"""
+    async def bot(history, conv_id, pdf):
+        """Process user message and stream the bot response into the chat history"""
         if not history or len(history) == 0:
-            return history, conv_id, pdf, "Error: No message to process"
+            yield history, conv_id, pdf, "Error: No message to process"
+            return
         
         user_message = history[-1]["content"]
         logger.info(f"Processing user message: {user_message[:50]}...")
         
         try:
-            response, new_conv_id = process_message(user_message, conv_id, pdf)
+            # Wait off the event loop so other sessions stay responsive while the agent starts
+            agent = await asyncio.to_thread(get_agent)
+            new_conv_id, pdf_job = prepare_conversation(conv_id, pdf)
+            logger.info(f"Processing message for conversation {new_conv_id}: {user_message}")
             
-            history.append({"role": "assistant", "content": response})
+            history.append({"role": "assistant", "content": ""})
+            async for kind, text in agent.astream_chat(user_message, thread_id=new_conv_id):
+                if kind == "token":
+                    history[-1]["content"] += text
+                    yield history, new_conv_id, None, "Generating response..."
+                else:
+                    # The final response replaces the streamed text (also covers errors)
+                    history[-1]["content"] = text
             
-            thread_msg_count = 0
-            if hasattr(agent, "conversation_threads") and new_conv_id in agent.conversation_threads:
-                thread_msg_count = len(agent.conversation_threads[new_conv_id])
+            thread_msg_count = agent.memory.message_count(new_conv_id)
+            logger.info(f"Thread {new_conv_id} now has {thread_msg_count} messages")
             
             debug_text = f"Conversation ID: {new_conv_id}\n"
             debug_text += f"UI Messages: {len(history)}\n"
             debug_text += f"Agent Thread Messages: {thread_msg_count}\n"
-            debug_text += f"PDF Uploaded: {'Yes' if pdf else 'No'}\n"
+            debug_text += f"PDF Uploaded: {describe_job(pdf_job)}\n"
+            debug_text += f"Ingestion Jobs Pending: {agent.ingestion.pending_count()}\n"
             
-            return history, new_conv_id, None, debug_text
+            yield history, new_conv_id, None, debug_text
         except Exception as e:
             error_msg = str(e)
             logger.error(f"Error processing message: {error_msg}")
             
-            history.append({"role": "assistant", "content": f"Error: {error_msg}"})
-            return history, conv_id, None, f"Error occurred: {error_msg}"
+            if history[-1]["role"] == "assistant":
+                history[-1]["content"] = f"Error: {error_msg}"
+            else:
+                history.append({"role": "assistant", "content": f"Error: {error_msg}"})
+            yield history, conv_id, None, f"Error occurred: {error_msg}"
     
     def clear_conversation():
         """Clear the current conversation and start a new one"""
@@ -170,4 +241,7 @@ with gr.Blocks(title="Medical Transcript Q&A System") as demo:
 if __name__ == "__main__":
     logger.info("Starting Medical Transcript Q&A System...")
     logger.info(f"API Key present: {'Yes' if os.getenv('ANTHROPIC_API_KEY') else 'No'}")
+    if os.getenv("EAGER_STARTUP") == "1":
+        # Old behaviour: only bind the UI once the agent is ready
+        agent_loader.wait()
     demo.launch()
\ No newline at end of file
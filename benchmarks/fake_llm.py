@@ -0,0 +1,43 @@
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+ANSWER = ("Based on the retrieved transcripts and web results, the procedure, its indications "
+          "and the usual recovery course are summarized below.").split()
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic stand-in for the Anthropic model, replies only depend on the kind of prompt"""
+
+    latency: float = 0.0
+    answer_words: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content if messages else ""
+        if "medical query router" in prompt:
+            return "document, web"
+        if "running summary" in prompt:
+            return "The user asked benchmark questions about surgical procedures."
+        return " ".join(ANSWER[i % len(ANSWER)] for i in range(self.answer_words))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
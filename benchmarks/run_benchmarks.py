@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.retriever_tool import DocumentRetriever
+from tools.pdf_tool import PDFProcessor
+from tools.search_tool import OfflineProvider, WebSearchTool
+from tools.embedding_backends import BACKENDS
+from agent import MedTranscriptAgent
+from benchmarks.fake_llm import ScriptedChatModel
+
+QUERIES = [
+    "What are the indications for a Youngswick bunionectomy?",
+    "Describe the findings of a laparoscopic cholecystectomy.",
+    "What anesthesia was used for the cataract surgery?",
+    "Postoperative diagnosis after a carpal tunnel release",
+    "Biopro implant screw fixation left foot",
+    "What complications are typical after a total knee arthroplasty?",
+    "How was the specimen handled during the excisional biopsy?",
+    "Estimated blood loss in a lumbar laminectomy",
+    "What is the recovery time after rotator cuff repair?",
+    "Patient positioning for a tonsillectomy and adenoidectomy",
+    "Which sutures were used to close the skin after hernia repair?",
+    "What are the inclusion criteria of the BENDITA trial?",
+]
+
+# Metrics where a larger value is better; for everything else (latency, memory) smaller is better
+HIGHER_IS_BETTER_SUFFIXES = ("_per_s",)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(samples_ms, prefix):
+    ordered = sorted(samples_ms)
+    metrics = {}
+    for p in (50, 95, 99):
+        # Nearest-rank percentile, exact for the small sample counts used here
+        rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        metrics[f"{prefix}.p{p}_ms"] = ordered[rank]
+    metrics[f"{prefix}.mean_ms"] = sum(ordered) / len(ordered)
+    return metrics
+
+
+def bench_startup():
+    """Import time of the heavy dependencies, measured in a fresh interpreter"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-m", "startup", "--json"], cwd=root, capture_output=True,
+                            text=True, check=True).stdout
+    timings = json.loads(output[output.index("{"):])
+    metrics = {f"startup.import.{name}_ms": seconds * 1000 for name, seconds in timings.items()}
+    metrics["startup.import_total_ms"] = sum(timings.values()) * 1000
+    return metrics
+
+
+def bench_index_build(csv_path, model_kwargs):
+    """Cold index build from the CSV, the persisted index cache is bypassed"""
+    start = time.perf_counter()
+    retriever = DocumentRetriever(csv_path, cache_dir=None, **model_kwargs)
+    seconds = time.perf_counter() - start
+    metrics = {
+        "index_build.total_ms": seconds * 1000,
+        "index_build.docs_per_s": retriever._num_docs / seconds,
+        "index_build.passages_per_s": len(retriever.store) / seconds,
+        "index_build.peak_rss_mb": peak_rss_mb(),
+    }
+    return retriever, metrics
+
+
+def bench_pdf_ingest(pdf_path, model_kwargs):
+    """Cold PDF extraction, chunking and embedding, the PDF cache is bypassed"""
+    processor = PDFProcessor(pdf_cache_dir=None, **model_kwargs)
+    start = time.perf_counter()
+    doc_id = processor.load_pdf(pdf_path)
+    seconds = time.perf_counter() - start
+    chunks = len(processor.pdf_docs[doc_id])
+    metrics = {
+        "pdf_ingest.total_ms": seconds * 1000,
+        "pdf_ingest.chunks_per_s": chunks / seconds,
+        "pdf_ingest.peak_rss_mb": peak_rss_mb(),
+    }
+    return processor, metrics
+
+
+def bench_queries(retriever, queries, repeats, batch_size):
+    """Single and batched retrieval latency with the query caches cleared, plus cache-hit latency"""
+    single = []
+    for _ in range(repeats):
+        for query in queries:
+            retriever.embedding_cache.clear()
+            retriever.result_cache.clear()
+            start = time.perf_counter()
+            retriever.query_batch([query])
+            single.append((time.perf_counter() - start) * 1000)
+
+    # The single-query runs clear the caches before every query, so fill them first
+    retriever.query_batch(queries)
+    cached = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.query_batch([query])
+        cached.append((time.perf_counter() - start) * 1000)
+
+    batched = []
+    for _ in range(repeats):
+        for i in range(0, len(queries), batch_size):
+            batch = queries[i:i + batch_size]
+            retriever.embedding_cache.clear()
+            retriever.result_cache.clear()
+            start = time.perf_counter()
+            retriever.query_batch(batch)
+            # Per-query cost, comparable with the single-query numbers
+            batched.append((time.perf_counter() - start) * 1000 / len(batch))
+
+    metrics = {}
+    metrics.update(percentiles(single, "query.single"))
+    metrics.update(percentiles(cached, "query.cached"))
+    metrics.update(percentiles(batched, "query.batched"))
+    metrics["query.single_per_s"] = 1000 / metrics["query.single.mean_ms"]
+    metrics["query.peak_rss_mb"] = peak_rss_mb()
+    return metrics
+
+
+def bench_chat(retriever, processor, queries, repeats, llm_latency):
+    """End-to-end chat turns with a scripted LLM and an offline web search provider"""
+    agent = MedTranscriptAgent(
+        llm=ScriptedChatModel(latency=llm_latency),
+        doc_retriever=retriever,
+        pdf_processor=processor,
+        web_search=WebSearchTool(providers=[OfflineProvider()], cache_path=None),
+    )
+    samples = []
+    for run in range(repeats):
+        thread_id = f"bench-{run}"
+        for query in queries:
+            start = time.perf_counter()
+            agent.chat(query, thread_id=thread_id)
+            samples.append((time.perf_counter() - start) * 1000)
+    metrics = percentiles(samples, "chat")
+    metrics["chat.peak_rss_mb"] = peak_rss_mb()
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """Metrics that got worse than the baseline by more than tolerance (a fraction)"""
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (value - base) / base
+        if name.endswith(HIGHER_IS_BETTER_SUFFIXES):
+            change = -change
+        if change > tolerance:
+            regressions.append((name, base, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion, retrieval and end-to-end agent benchmarks")
+    parser.add_argument("--csv", default="data/mtsamples_surgery.csv")
+    parser.add_argument("--pdf", default="data/DNDi-Clinical-Trial-Protocol-BENDITA-V5.pdf")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument("--embedding-backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--model", help="Embedding model (name or local path) for both sources, "
+                                        "defaults to each tool's own model")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["startup", "pdf", "queries", "chat"])
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results to --baseline")
+    args = parser.parse_args()
+
+    model_kwargs = {"embedding_backend": args.embedding_backend}
+    if args.model:
+        model_kwargs["model_name"] = args.model
+
+    metrics = {}
+    if "startup" not in args.skip:
+        metrics.update(bench_startup())
+    retriever, build_metrics = bench_index_build(args.csv, model_kwargs)
+    metrics.update(build_metrics)
+
+    processor = None
+    if "pdf" not in args.skip:
+        processor, pdf_metrics = bench_pdf_ingest(args.pdf, model_kwargs)
+        metrics.update(pdf_metrics)
+    if "queries" not in args.skip:
+        metrics.update(bench_queries(retriever, QUERIES, args.repeats, args.batch_size))
+    if "chat" not in args.skip:
+        processor = processor or PDFProcessor(pdf_cache_dir=None, **model_kwargs)
+        metrics.update(bench_chat(retriever, processor, QUERIES, args.repeats, args.llm_latency))
+
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "metrics": metrics,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for name, value in sorted(metrics.items()):
+        print(f"{name:<32} {value:>12.2f}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        regressions = compare(metrics, baseline, args.tolerance)
+        for name, base, value, change in regressions:
+            print(f"REGRESSION {name}: {base:.2f} -> {value:.2f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.retriever_tool import DocumentRetriever
+
+
+def check(condition, message):
+    if not condition:
+        raise SystemExit(f"SMOKE CHECK FAILED: {message}")
+    print(f"ok  {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold index build, cache round trip and query on a few CSV rows")
+    parser.add_argument("--csv", default="data/mtsamples_surgery.csv")
+    parser.add_argument("--rows", type=int, default=5)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Model name or local SentenceTransformer path")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="smoke_")
+    try:
+        csv_path = os.path.join(work_dir, "sample.csv")
+        pd.read_csv(args.csv).head(args.rows).to_csv(csv_path, index=False)
+
+        # Cold build without a cache, the path every first start and fingerprint change takes
+        retriever = DocumentRetriever(csv_path, cache_dir=None, model_name=args.model)
+        check(len(retriever.store) >= args.rows, f"cold build indexed all {args.rows} transcripts")
+        check(retriever.index.ntotal == len(retriever.store), "index and store hold the same passages")
+        check(len(retriever.query_batch(["surgery"])[0]) > 0, "query returns hits")
+        retriever.close()
+
+        # Cold build that persists the cache, then a warm start from it
+        cache_dir = os.path.join(work_dir, "index_cache")
+        built = DocumentRetriever(csv_path, cache_dir=cache_dir, model_name=args.model)
+        num_passages = len(built.store)
+        built.close()
+        loaded = DocumentRetriever(csv_path, cache_dir=cache_dir, model_name=args.model)
+        check(len(loaded.store) == num_passages, "index cache reloads the same passages")
+        check(len(loaded.query_batch(["surgery"])[0]) > 0, "query on the cached index returns hits")
+        loaded.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+from thread_store import estimate_tokens
+
+
+@dataclass
+class ContextItem:
+    """One retrieved passage, ready to be placed in the answer prompt"""
+    source: str
+    label: str
+    text: str
+    score: float = 0.0
+
+    def render(self) -> str:
+        return f"{self.label}\n{self.text}" if self.label else self.text
+
+
+def pack_context(items_by_source: Dict[str, List[ContextItem]], budget_tokens: int,
+                 min_item_tokens: int = 60) -> Dict[str, List[ContextItem]]:
+    """Fit the best passages from all sources into a shared token budget.
+
+    Scores from different sources are not comparable, so sources take turns:
+    every source's best item goes in first, then every source's second best,
+    and so on. An item that does not fit is truncated if at least
+    min_item_tokens remain, otherwise it and the rest of its source are dropped.
+    """
+    ranked = {source: sorted(items, key=lambda item: item.score, reverse=True)
+              for source, items in items_by_source.items() if items}
+    packed = {source: [] for source in items_by_source}
+    remaining = budget_tokens
+    depth = 0
+    active = list(ranked)
+    while active and remaining > 0:
+        still_active = []
+        for source in active:
+            items = ranked[source]
+            if depth >= len(items):
+                continue
+            item = items[depth]
+            cost = estimate_tokens(item.render())
+            if cost <= remaining:
+                packed[source].append(item)
+                remaining -= cost
+                still_active.append(source)
+            elif remaining >= min_item_tokens:
+                keep_chars = max(0, remaining * 4 - len(item.label) - 8)
+                packed[source].append(ContextItem(item.source, item.label, item.text[:keep_chars] + " ...", item.score))
+                remaining = 0
+        active = still_active
+        depth += 1
+    return packed
+
+
+def format_packed(items: List[ContextItem]) -> str:
+    return "\n\n".join(item.render() for item in items)
@@ -0,0 +1,110 @@
+from typing import Callable, List, Optional
+
+from thread_store import InMemoryThreadStore, ThreadStore, Turn, estimate_tokens
+
+
+class ConversationMemory:
+    """Append-only conversation memory with token-budgeted history views.
+
+    Turns are appended once to a ThreadStore and never copied around. Prompts
+    get a view of the thread: the rolling summary of older turns plus as many
+    recent turns as fit the token budget. compact() folds old turns into the
+    summary once the unsummarized part of a thread grows past
+    summary_trigger_tokens.
+    """
+
+    def __init__(self, summarizer: Optional[Callable[[str, List[Turn]], str]] = None,
+                 store: Optional[ThreadStore] = None,
+                 router_budget_tokens: int = 400, response_budget_tokens: int = 2000,
+                 summary_trigger_tokens: int = 3000, keep_recent_tokens: int = 1500):
+        self.summarizer = summarizer or extractive_summary
+        self.store = store or InMemoryThreadStore()
+        self.router_budget_tokens = router_budget_tokens
+        self.response_budget_tokens = response_budget_tokens
+        self.summary_trigger_tokens = summary_trigger_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+
+    def append(self, thread_id: str, user: str, assistant: str):
+        self.store.append_turn(thread_id, Turn(user, assistant))
+
+    def has_history(self, thread_id: str) -> bool:
+        return self.store.turn_count(thread_id) > 0
+
+    def message_count(self, thread_id: str) -> int:
+        return 2 * self.store.turn_count(thread_id)
+
+    def needs_compaction(self, thread_id: str) -> bool:
+        state = self.store.load(thread_id)
+        if state is None:
+            return False
+        return sum(turn.tokens for turn in state.recent_turns) > self.summary_trigger_tokens
+
+    def compact(self, thread_id: str):
+        """Fold the oldest unsummarized turns into the rolling summary"""
+        state = self.store.load(thread_id)
+        if state is None:
+            return
+        recent = state.recent_turns
+        total = sum(turn.tokens for turn in recent)
+        if total <= self.summary_trigger_tokens:
+            return
+        fold = 0
+        while fold < len(recent) - 1 and total > self.keep_recent_tokens:
+            total -= recent[fold].tokens
+            fold += 1
+        if fold == 0:
+            return
+
+        new_summary = self.summarizer(state.summary, recent[:fold])
+        # Compare-and-set: a concurrent compaction of the same thread wins and ours is dropped
+        self.store.update_summary(thread_id, new_summary, state.summarized_upto, state.summarized_upto + fold)
+
+    def render(self, thread_id: str, budget_tokens: int, max_reply_chars: Optional[int] = None) -> str:
+        """Summary plus the most recent turns that fit in budget_tokens"""
+        state = self.store.load(thread_id)
+        if state is None or (not state.recent_turns and not state.summary):
+            return "No previous conversation"
+
+        remaining = budget_tokens
+        parts = []
+        if state.summary:
+            parts.append(f"Summary of earlier conversation: {state.summary}")
+            remaining -= estimate_tokens(parts[0])
+
+        selected = []
+        for turn in reversed(state.recent_turns):
+            reply = turn.assistant
+            if max_reply_chars and len(reply) > max_reply_chars:
+                reply = reply[:max_reply_chars] + "..."
+            text = f"Human: {turn.user}\nAI: {reply}"
+            cost = estimate_tokens(text)
+            if cost > remaining and selected:
+                break
+            if cost > remaining:
+                # Always keep the last turn, trimmed to whatever budget is left
+                text = text[:max(remaining, 1) * 4] + "..."
+                cost = remaining
+            selected.append(text)
+            remaining -= cost
+
+        parts.extend(reversed(selected))
+        return "\n\n".join(parts)
+
+    def router_view(self, thread_id: str) -> str:
+        """Short view for the router: little budget, assistant replies clipped"""
+        return self.render(thread_id, self.router_budget_tokens, max_reply_chars=300)
+
+    def response_view(self, thread_id: str) -> str:
+        return self.render(thread_id, self.response_budget_tokens)
+
+    def clear(self, thread_id: str):
+        self.store.delete(thread_id)
+
+
+def extractive_summary(previous: str, turns: List[Turn], max_chars: int = 1200) -> str:
+    """Fallback summarizer without an LLM: keep the user questions and clipped answers"""
+    lines = [previous] if previous else []
+    for turn in turns:
+        lines.append(f"User asked: {turn.user[:200]} / Answer: {turn.assistant[:200]}")
+    summary = " ".join(lines)
+    return summary[-max_chars:]
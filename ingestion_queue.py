@@ -0,0 +1,113 @@
+import time
+import uuid
+import threading
+import dataclasses
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    kind: str
+    description: str
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+class IngestionQueue:
+    """Runs ingestion work (PDF loads, add_documents) off the request path.
+
+    Jobs run on a small worker pool in submission order. Each job function is
+    called with a progress(fraction, message) callback; status() returns a
+    snapshot of the job that is safe to read from any thread. The ingestion
+    targets swap their indexes in only once a job's data is complete, so
+    queries keep answering from what is already indexed meanwhile.
+    """
+
+    def __init__(self, max_workers: int = 1, max_history: int = 200):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, description: str, func: Callable, *args, **kwargs) -> IngestionJob:
+        job = IngestionJob(job_id=uuid.uuid4().hex, kind=kind, description=description, submitted_at=time.time())
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._events[job.job_id] = threading.Event()
+            self._trim()
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return self.status(job.job_id)
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond max_history"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_history:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+                self._events.pop(job_id, None)
+
+    def _update(self, job: IngestionJob, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                setattr(job, key, value)
+
+    def _run(self, job: IngestionJob, func: Callable, args, kwargs):
+        self._update(job, status=RUNNING, started_at=time.time())
+
+        def progress(fraction: float, message: str = ""):
+            self._update(job, progress=max(0.0, min(1.0, fraction)), message=message)
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            self._update(job, status=DONE, progress=1.0, result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"[Ingestion] Job {job.job_id} ({job.description}) failed: {e}")
+            self._update(job, status=FAILED, error=str(e), finished_at=time.time())
+        finally:
+            event = self._events.get(job.job_id)
+            if event is not None:
+                event.set()
+
+    def status(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dataclasses.replace(job) if job is not None else None
+
+    def jobs(self, kind: Optional[str] = None) -> List[IngestionJob]:
+        with self._lock:
+            return [dataclasses.replace(job) for job in self._jobs.values() if kind is None or job.kind == kind]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[IngestionJob]:
+        """Block until the job finished or timeout passed, returns its status"""
+        event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.status(job_id)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
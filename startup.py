@@ -0,0 +1,156 @@
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Third-party modules behind the agent, in the order the agent imports them
+AGENT_MODULES = [
+    "numpy",
+    "pandas",
+    "faiss",
+    "torch",
+    "sentence_transformers",
+    "pypdf",
+    "langchain_core",
+    "langchain_text_splitters",
+    "langchain_anthropic",
+    "langgraph.graph",
+]
+# The UI imports gradio itself, on the main thread
+HEAVY_MODULES = AGENT_MODULES + ["gradio"]
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+def profile_imports(modules: List[str]) -> List[Tuple[str, float]]:
+    """Import the modules one by one and return (module, seconds) for each.
+
+    A module's time includes its dependencies that were not imported yet, so
+    the numbers depend on the order and on what the process already loaded.
+    """
+    timings = []
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"[Startup] Could not import {name}: {e}")
+            continue
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+
+def format_profile(timings: List[Tuple[str, float]]) -> str:
+    lines = [f"{name:<28} {seconds * 1000:>10.1f} ms" for name, seconds in timings]
+    lines.append(f"{'total':<28} {sum(seconds for _, seconds in timings) * 1000:>10.1f} ms")
+    return "\n".join(lines)
+
+
+class AgentLoader:
+    """Builds the agent on a background thread so the process can report healthy right away.
+
+    The heavy imports are profiled first, then factory() builds and warms up
+    the agent. status() reports progress for a readiness probe and wait()
+    blocks until the agent is available.
+    """
+
+    def __init__(self, factory: Callable[[], Any], modules: Optional[List[str]] = None):
+        self.factory = factory
+        self.modules = AGENT_MODULES if modules is None else modules
+        self.state = STARTING
+        self.phase = "pending"
+        self.error = None
+        self.import_profile = []
+        self.phase_seconds = {}
+        self._agent = None
+        self._started_at = None
+        self._ready = threading.Event()
+
+    def start(self) -> "AgentLoader":
+        self._started_at = time.time()
+        threading.Thread(target=self._run, name="agent-loader", daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self.phase = "imports"
+            start = time.perf_counter()
+            self.import_profile = profile_imports(self.modules)
+            self.phase_seconds["imports"] = time.perf_counter() - start
+            print(f"[Startup] Import profile:\n{format_profile(self.import_profile)}")
+
+            self.phase = "agent"
+            start = time.perf_counter()
+            self._agent = self.factory()
+            self.phase_seconds["agent"] = time.perf_counter() - start
+            self.state = READY
+            self.phase = "done"
+            print(f"[Startup] Agent ready after {time.time() - self._started_at:.1f}s")
+        except Exception as e:
+            print(f"[Startup] Agent initialization failed in phase {self.phase}: {e}")
+            self.error = str(e)
+            self.state = FAILED
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def wait(self, timeout: Optional[float] = None):
+        """The agent once it is built, None if it failed or timeout passed"""
+        self._ready.wait(timeout)
+        return self._agent if self.ready else None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "phase": self.phase,
+            "error": self.error,
+            "elapsed_seconds": time.time() - self._started_at if self._started_at else 0.0,
+            "phase_seconds": dict(self.phase_seconds),
+            "import_profile": {name: seconds for name, seconds in self.import_profile},
+        }
+
+    def routes(self) -> Dict[str, Callable]:
+        """/health is up as soon as the process is; /ready only once the agent can answer"""
+        def health():
+            return 200, "application/json", json.dumps({"status": "ok"})
+
+        def ready():
+            status = self.status()
+            return (200 if self.ready else 503), "application/json", json.dumps(status)
+
+        return {"/health": health, "/ready": ready}
+
+    def collect_metrics(self):
+        """Readiness and startup timings for the instrumentation's Prometheus output"""
+        yield "agent_ready", "gauge", {}, 1 if self.ready else 0
+        for phase, seconds in self.phase_seconds.items():
+            yield "startup_phase_seconds", "gauge", {"phase": phase}, seconds
+        for name, seconds in self.import_profile:
+            yield "startup_import_seconds", "gauge", {"module": name}, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the app's heavy dependencies")
+    parser.add_argument("--json", action="store_true", help="Print the timings as JSON")
+    parser.add_argument("modules", nargs="*", help=f"Modules to import, defaults to {', '.join(HEAVY_MODULES)}")
+    args = parser.parse_args()
+
+    # Run in a fresh process so nothing is imported yet
+    timings = profile_imports(args.modules or HEAVY_MODULES)
+    if args.json:
+        json.dump({name: seconds for name, seconds in timings}, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_profile(timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from tools.instrumentation import instrumentation
+from tools.pdf_tool import PDFProcessor
+
+
+def test_uncached_pdf_load_is_instrumented(tmp_path, test_model, write_pdf):
+    pdf_path = write_pdf(tmp_path / "protocol.pdf", [
+        ["Inclusion criteria: adults with chronic Chagas disease.", "Participants receive benznidazole daily."],
+        ["Adverse events are recorded at every visit.", "Follow-up lasts twelve months."],
+    ])
+    processor = PDFProcessor(pdf_cache_dir=str(tmp_path / "pdf_cache"), model_name=test_model)
+    try:
+        # Nothing is cached yet, so the load goes through the pdf.extract and pdf.embed spans
+        doc_id = processor.load_pdf(str(pdf_path))
+        assert doc_id in processor.pdf_docs
+        assert len(processor.store) > 0
+        assert "benznidazole" in processor.search_hits("benznidazole", k=1)[0].text
+
+        metrics = instrumentation.render_prometheus()
+        assert 'span="pdf.extract"' in metrics
+        assert 'span="pdf.embed"' in metrics
+    finally:
+        processor.close()
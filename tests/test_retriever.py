@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from tools.retriever_tool import DocumentRetriever
+
+ROWS = [
+    {"transcription": "PROCEDURE: Left total knee arthroplasty. The patient tolerated the procedure well.",
+     "description": "Total knee replacement", "medical_specialty": "Orthopedic", "sample_name": "Knee Arthroplasty",
+     "keywords": "orthopedic, knee, arthroplasty"},
+    {"transcription": "PROCEDURE: Laparoscopic cholecystectomy. Estimated blood loss was minimal.",
+     "description": "Gallbladder removal", "medical_specialty": "Gastroenterology",
+     "sample_name": "Cholecystectomy", "keywords": "gastroenterology, gallbladder, cholecystectomy"},
+]
+
+
+@pytest.fixture
+def retriever(tmp_path, test_model):
+    csv_path = tmp_path / "sample.csv"
+    pd.DataFrame(ROWS).to_csv(csv_path, index=False)
+    retriever = DocumentRetriever(str(csv_path), cache_dir=None, model_name=test_model)
+    yield retriever
+    retriever.close()
+
+
+def test_add_documents_rejects_metadata_of_other_length(retriever):
+    num_passages = len(retriever.store)
+    with pytest.raises(ValueError):
+        retriever.add_documents(["Right carpal tunnel release.", "Tonsillectomy and adenoidectomy."],
+                                [{"medical_specialty": "Orthopedic"}])
+    assert len(retriever.store) == num_passages
+    assert retriever.index.ntotal == num_passages
+
+
+def test_add_documents_keeps_metadata(retriever):
+    retriever.add_documents(["PROCEDURE: Right carpal tunnel release."], [{"medical_specialty": "Neurosurgery"}])
+    hits = retriever.query_batch(["carpal tunnel release"], mode="lexical")[0]
+    assert hits[0].metadata["medical_specialty"] == "Neurosurgery"
+    assert retriever.index.ntotal == len(retriever.store)
@@ -0,0 +1,214 @@
+import os
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for budgeting prompts"""
+    return len(text) // 4 + 1
+
+
+@dataclass
+class Turn:
+    user: str
+    assistant: str
+    tokens: int = 0
+
+    def __post_init__(self):
+        if not self.tokens:
+            self.tokens = estimate_tokens(self.user) + estimate_tokens(self.assistant)
+
+
+@dataclass
+class ThreadState:
+    """What prompts need from a thread: the summary and the turns it does not cover yet"""
+    summary: str = ""
+    summarized_upto: int = 0
+    recent_turns: List[Turn] = field(default_factory=list)
+    turn_count: int = 0
+
+
+class ThreadStore(ABC):
+    """Storage backend for conversation threads"""
+
+    @abstractmethod
+    def load(self, thread_id: str) -> Optional[ThreadState]:
+        ...
+
+    @abstractmethod
+    def append_turn(self, thread_id: str, turn: Turn):
+        ...
+
+    @abstractmethod
+    def update_summary(self, thread_id: str, summary: str, expected_upto: int, new_upto: int) -> bool:
+        """Set the summary if nobody else moved summarized_upto since expected_upto was read"""
+
+    @abstractmethod
+    def delete(self, thread_id: str):
+        ...
+
+    def turn_count(self, thread_id: str) -> int:
+        state = self.load(thread_id)
+        return state.turn_count if state else 0
+
+
+@dataclass
+class _MemoryThread:
+    state: ThreadState
+    last_access: float
+
+
+class InMemoryThreadStore(ThreadStore):
+    """Per-process store bounded by thread count and idle time.
+
+    Turns already folded into the summary are dropped, so a thread holds at
+    most its summary plus the recent turns.
+    """
+
+    def __init__(self, max_threads: int = 1000, idle_ttl: float = 2 * 3600):
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._threads:
+            thread_id, thread = next(iter(self._threads.items()))
+            if len(self._threads) > self.max_threads or now - thread.last_access > self.idle_ttl:
+                del self._threads[thread_id]
+            else:
+                break
+
+    def _get(self, thread_id: str, create: bool = False) -> Optional[_MemoryThread]:
+        now = time.monotonic()
+        thread = self._threads.get(thread_id)
+        if thread is None and create:
+            thread = self._threads[thread_id] = _MemoryThread(ThreadState(), now)
+        if thread is not None:
+            thread.last_access = now
+            self._threads.move_to_end(thread_id)
+        self._evict(now)
+        return thread
+
+    def load(self, thread_id: str) -> Optional[ThreadState]:
+        with self._lock:
+            thread = self._get(thread_id)
+            if thread is None:
+                return None
+            state = thread.state
+            return ThreadState(state.summary, state.summarized_upto, list(state.recent_turns), state.turn_count)
+
+    def append_turn(self, thread_id: str, turn: Turn):
+        with self._lock:
+            state = self._get(thread_id, create=True).state
+            state.recent_turns.append(turn)
+            state.turn_count += 1
+
+    def update_summary(self, thread_id: str, summary: str, expected_upto: int, new_upto: int) -> bool:
+        with self._lock:
+            thread = self._get(thread_id)
+            if thread is None or thread.state.summarized_upto != expected_upto:
+                return False
+            state = thread.state
+            del state.recent_turns[:new_upto - expected_upto]
+            state.summary = summary
+            state.summarized_upto = new_upto
+            return True
+
+    def delete(self, thread_id: str):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict(time.monotonic())
+
+
+class SQLiteThreadStore(ThreadStore):
+    """Threads persisted in SQLite, shared by every worker process pointing at the same file"""
+
+    def __init__(self, path: str = "data/threads.sqlite"):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized_upto INTEGER NOT NULL DEFAULT 0,
+                turn_count INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS turns (
+                thread_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                user TEXT NOT NULL,
+                assistant TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (thread_id, seq)
+            );
+        """)
+        self._conn.commit()
+
+    def load(self, thread_id: str) -> Optional[ThreadState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_upto, turn_count FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            summary, summarized_upto, turn_count = row
+            turns = self._conn.execute(
+                "SELECT user, assistant, tokens FROM turns WHERE thread_id = ? AND seq >= ? ORDER BY seq",
+                (thread_id, summarized_upto),
+            ).fetchall()
+        return ThreadState(summary, summarized_upto, [Turn(*turn) for turn in turns], turn_count)
+
+    def append_turn(self, thread_id: str, turn: Turn):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            # The turn count is bumped inside the write transaction so concurrent workers get distinct seqs
+            self._conn.execute(
+                "UPDATE threads SET turn_count = turn_count + 1, updated_at = ? WHERE thread_id = ?",
+                (time.time(), thread_id),
+            )
+            seq = self._conn.execute(
+                "SELECT turn_count - 1 FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO turns (thread_id, seq, user, assistant, tokens) VALUES (?, ?, ?, ?, ?)",
+                (thread_id, seq, turn.user, turn.assistant, turn.tokens),
+            )
+
+    def update_summary(self, thread_id: str, summary: str, expected_upto: int, new_upto: int) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE threads SET summary = ?, summarized_upto = ?, updated_at = ? "
+                "WHERE thread_id = ? AND summarized_upto = ?",
+                (summary, new_upto, time.time(), thread_id, expected_upto),
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, thread_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM turns WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def delete_idle(self, idle_seconds: float):
+        """Remove threads not used for idle_seconds"""
+        cutoff = time.time() - idle_seconds
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM turns WHERE thread_id IN (SELECT thread_id FROM threads WHERE updated_at < ?)", (cutoff,)
+            )
+            self._conn.execute("DELETE FROM threads WHERE updated_at < ?", (cutoff,))
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import math
+from array import array
+from typing import List, Tuple
+import numpy as np
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in into is it its of on or she that the their "
+    "then there these they this to was were which with what when where who how why does did do can you your "
+    "about any all".split()
+)
+
+VOCAB_FILE = "bm25_vocab.json"
+ARRAY_FILES = ("offsets", "ids", "tfs", "lengths")
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _array_file(name):
+    return f"bm25_{name}.npy"
+
+
+class BM25Index:
+    """In-process BM25 over the document store passages.
+
+    Postings are kept in CSR form: one offsets array into flat int32 arrays of
+    passage ids and term frequencies. Passages added after a load or compact()
+    go into small per-term tails, so the index grows incrementally alongside
+    the FAISS index without rebuilding the flat arrays.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.int32)
+        self._base_lengths = np.zeros(0, dtype=np.int32)
+        self._tail = {}
+        self._tail_lengths = array("i")
+        self._total_length = 0
+        self._norm = None
+
+    def __len__(self):
+        return len(self._base_lengths) + len(self._tail_lengths)
+
+    def add(self, texts):
+        """Index texts as the next passage ids"""
+        for text in texts:
+            doc_id = len(self)
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_id = self.vocabulary.setdefault(token, len(self.vocabulary))
+                postings = self._tail.get(term_id)
+                if postings is None:
+                    postings = self._tail[term_id] = (array("i"), array("i"))
+                postings[0].append(doc_id)
+                postings[1].append(tf)
+            self._tail_lengths.append(len(tokens))
+            self._total_length += len(tokens)
+
+    def _postings(self, term_id):
+        ids, tfs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        if term_id + 1 < len(self._offsets):
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            ids, tfs = self._ids[start:end], self._tfs[start:end]
+        tail = self._tail.get(term_id)
+        if tail is not None:
+            # add() appends the id before the tf; reading the tf count first keeps both aligned
+            # while another thread is adding
+            count = len(tail[1])
+            ids = np.concatenate([ids, np.array(tail[0][:count], dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.array(tail[1][:count], dtype=np.int32)])
+        return ids, tfs
+
+    def _length_norm(self):
+        """Per-passage BM25 length normalization, recomputed only after adds"""
+        # Compare sizes instead of relying on add() resetting it: a search racing an add may store a stale one
+        if self._norm is None or len(self._norm) != len(self):
+            lengths = np.concatenate([self._base_lengths, np.array(self._tail_lengths, dtype=np.int32)])
+            avg_length = max(self._total_length / max(len(lengths), 1), 1.0)
+            self._norm = (self.k1 * (1 - self.b + self.b * lengths / avg_length)).astype(np.float32)
+        return self._norm
+
+    def idf(self, term):
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return 0.0
+        df = len(self._postings(term_id)[0])
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k, allowed=None, limit=None) -> List[Tuple[int, float]]:
+        """Top-k (passage id, score) pairs for the query, best first, only passages sharing a term.
+
+        allowed is an optional boolean mask over passage ids to restrict the
+        search to; limit hides passages with ids at or past it, e.g. ones
+        added while the vector index is still being rebuilt.
+        """
+        term_ids = {self.vocabulary.get(token) for token in tokenize(query)} - {None}
+        if not term_ids or k <= 0:
+            return []
+        # Passages indexed after the norm snapshot was taken are ignored
+        norm = self._length_norm()
+        num_docs = len(norm) if limit is None else min(limit, len(norm))
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term_id in term_ids:
+            ids, tfs = self._postings(term_id)
+            idf = math.log(1 + (len(norm) - len(ids) + 0.5) / (len(ids) + 0.5))
+            visible = ids < num_docs
+            ids, tfs = ids[visible], tfs[visible]
+            # Passage ids are unique within a posting list, so plain fancy-index += is safe
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+
+        if allowed is not None:
+            scores[~allowed[:num_docs]] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(idx), float(scores[idx])) for idx in order]
+
+    def compact(self):
+        """Merge the per-term tails into the flat posting arrays"""
+        if not self._tail and not self._tail_lengths:
+            return
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        ids, tfs = [], []
+        for term_id in range(len(self.vocabulary)):
+            term_ids, term_tfs = self._postings(term_id)
+            ids.append(term_ids)
+            tfs.append(term_tfs)
+            offsets[term_id + 1] = offsets[term_id] + len(term_ids)
+        self._offsets = offsets
+        self._ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+        self._tfs = np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.int32)
+        self._base_lengths = np.concatenate([self._base_lengths, np.array(self._tail_lengths, dtype=np.int32)])
+        self._tail = {}
+        self._tail_lengths = array("i")
+
+    def save(self, directory):
+        self.compact()
+        arrays = {"offsets": self._offsets, "ids": self._ids, "tfs": self._tfs, "lengths": self._base_lengths}
+        for name in ARRAY_FILES:
+            np.save(os.path.join(directory, _array_file(name)), arrays[name])
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": sorted(self.vocabulary, key=self.vocabulary.get)}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Open a saved index, the posting arrays are memory-mapped"""
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        index = cls(k1=vocab["k1"], b=vocab["b"])
+        index.vocabulary = {term: term_id for term_id, term in enumerate(vocab["terms"])}
+        arrays = {name: np.load(os.path.join(directory, _array_file(name)), mmap_mode="r") for name in ARRAY_FILES}
+        index._offsets = arrays["offsets"]
+        index._ids = arrays["ids"]
+        index._tfs = arrays["tfs"]
+        index._base_lengths = arrays["lengths"]
+        index._total_length = int(np.sum(arrays["lengths"], dtype=np.int64))
+        return index
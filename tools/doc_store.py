@@ -0,0 +1,313 @@
+import os
+import json
+import math
+import mmap
+import shutil
+import weakref
+import tempfile
+from array import array
+import numpy as np
+
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.bin"
+METADATA_FILE = "metadata.json"
+
+
+def _column_file(field):
+    return f"meta_{field}.bin"
+
+
+def _values_file(field):
+    return f"meta_{field}.values.bin"
+
+
+def _value_offsets_file(field):
+    return f"meta_{field}.offsets.bin"
+
+
+def _map_file(path):
+    """Read-only mmap of a file, None when it is empty"""
+    if not os.path.getsize(path):
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _remove_dirs(paths):
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _normalize_value(value):
+    # pandas hands missing cells over as float NaN, store them as None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ValueTable:
+    """Unique values of a metadata column, indexed by code.
+
+    Values of a flushed column are UTF-8 (kind "str") or JSON (any other
+    kind) entries of a mapped blob addressed by an int64 offsets array, like
+    the texts; only values added since opening are held in Python.
+    """
+
+    def __init__(self, kind="str", blob=None, offsets=None):
+        self.kind = kind
+        self._blob = blob
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self._tail = []
+
+    def __len__(self):
+        return len(self._offsets) - 1 + len(self._tail)
+
+    def __getitem__(self, code):
+        base = len(self._offsets) - 1
+        if code >= base:
+            return self._tail[code - base]
+        data = self._blob[int(self._offsets[code]):int(self._offsets[code + 1])] if self._blob is not None else b""
+        return data.decode("utf-8") if self.kind == "str" else json.loads(data)
+
+    def __iter__(self):
+        return (self[code] for code in range(len(self)))
+
+    def append(self, value):
+        self._tail.append(value)
+
+    def write(self, values_path, offsets_path):
+        kind = "str" if all(isinstance(value, str) for value in self) else "json"
+        offsets = array("q", [0])
+        with open(values_path, "wb") as f:
+            for value in self:
+                data = (value if kind == "str" else json.dumps(value)).encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.frombuffer(offsets, dtype=np.int64).tofile(offsets_path)
+        return kind
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+
+
+class MetadataColumn:
+    """Dictionary-encoded metadata field: unique values plus one int32 code per document.
+
+    Values appended after opening a flushed column are only deduplicated
+    among themselves, so looking them up never loads the mapped values.
+    """
+
+    def __init__(self, values=None, codes=None):
+        self.values = values if values is not None else ValueTable()
+        self._lookup = {}
+        self._base = codes if codes is not None else np.zeros(0, dtype=np.int32)
+        self._tail = array("i")
+
+    def __len__(self):
+        return len(self._base) + len(self._tail)
+
+    def pad(self, length):
+        """Extend with missing values (-1) up to length, used when a field first appears"""
+        missing = length - len(self)
+        if missing > 0:
+            self._tail.extend([-1] * missing)
+
+    def append(self, value):
+        if value is None:
+            self._tail.append(-1)
+            return
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._lookup[value] = code
+        self._tail.append(code)
+
+    def code(self, idx):
+        base = len(self._base)
+        return int(self._base[idx]) if idx < base else self._tail[idx - base]
+
+    def value(self, idx):
+        code = self.code(idx)
+        return self.values[code] if code >= 0 else None
+
+    def codes(self):
+        """All codes as one array (a view of the mapped file when nothing was appended)"""
+        if not self._tail:
+            return self._base
+        return np.concatenate([self._base, np.frombuffer(self._tail, dtype=np.int32)])
+
+
+class DocumentStore:
+    """Compact document store backed by memory-mapped files.
+
+    Texts live in one contiguous UTF-8 blob addressed by an int64 offsets
+    array, and metadata is stored column by column as dictionary codes into
+    value tables laid out the same way. Once flushed, all of it is read
+    through mmap so worker processes share the pages instead of each holding
+    its own Python strings and dicts.
+
+    A flushed store may be opened by several processes at once, so its files
+    are never written in place: texts appended after opening go to a private
+    overlay file of this process (offsets and metadata stay in small
+    in-memory tails) until flush() replaces the files. A temporary store
+    deletes its directory when closed, garbage collected or at exit.
+    """
+
+    def __init__(self, directory, temporary=False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.columns = {}
+        self._offsets_base = np.zeros(1, dtype=np.int64)
+        self._offsets_tail = array("q")
+        self._blob_map = None
+        self._appends = None
+        self._overlay_dir = None
+        # Directories this store owns; the finalizer must not reference self
+        self._owned_dirs = [directory] if temporary else []
+        self._cleanup = weakref.finalize(self, _remove_dirs, self._owned_dirs)
+
+        offsets_path = os.path.join(directory, OFFSETS_FILE)
+        self._persisted = os.path.exists(offsets_path) and os.path.getsize(offsets_path) > 0
+        if self._persisted:
+            self._offsets_base = np.memmap(offsets_path, dtype=np.int64, mode="r")
+            # metadata.json only names the columns and how their values are encoded
+            with open(os.path.join(directory, METADATA_FILE), "r", encoding="utf-8") as f:
+                fields = json.load(f)["fields"]
+            for field, kind in fields.items():
+                codes_path = os.path.join(directory, _column_file(field))
+                codes = np.memmap(codes_path, dtype=np.int32, mode="r") if os.path.getsize(codes_path) else None
+                values = ValueTable(kind, _map_file(os.path.join(directory, _values_file(field))),
+                                    np.memmap(os.path.join(directory, _value_offsets_file(field)), dtype=np.int64,
+                                              mode="r"))
+                self.columns[field] = MetadataColumn(values, codes)
+
+        # Texts up to base_size come from the persisted blob, later ones from the append file
+        self._base_size = int(self._offsets_base[-1])
+        if self._base_size:
+            self._blob_map = _map_file(os.path.join(directory, TEXTS_FILE))
+        if not self._persisted:
+            # A new store owns its directory and appends to the blob directly
+            self._appends = open(os.path.join(directory, TEXTS_FILE), "a+b")
+            self._appends.truncate(0)
+
+    @classmethod
+    def temporary(cls, prefix="doc_store_"):
+        return cls(tempfile.mkdtemp(prefix=prefix), temporary=True)
+
+    def __len__(self):
+        return len(self._offsets_base) + len(self._offsets_tail) - 1
+
+    def _offset(self, i):
+        base = len(self._offsets_base)
+        return int(self._offsets_base[i]) if i < base else self._offsets_tail[i - base]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        start, end = self._offset(idx), self._offset(idx + 1)
+        if start == end:
+            return ""
+        if end <= self._base_size:
+            data = self._blob_map[start:end]
+        else:
+            data = os.pread(self._appends.fileno(), end - start, start - self._base_size)
+        return data.decode("utf-8")
+
+    def metadata(self, idx):
+        meta = {}
+        for field, column in self.columns.items():
+            value = column.value(idx)
+            if value is not None:
+                meta[field] = value
+        return meta
+
+    def append(self, text, metadata=None):
+        idx = self._append(text, metadata)
+        self._appends.flush()
+        return idx
+
+    def extend(self, texts, metadatas=None):
+        metadatas = metadatas or [None] * len(texts)
+        ids = [self._append(text, meta) for text, meta in zip(texts, metadatas)]
+        # Appended texts are read back with pread, which bypasses Python's buffer
+        if self._appends is not None:
+            self._appends.flush()
+        return ids
+
+    def _append_file(self):
+        if self._appends is None:
+            # Other processes may have this store open: appending to its blob would interleave
+            # with their additions, so additions of this process go to a private overlay
+            self._overlay_dir = tempfile.mkdtemp(prefix="doc_store_overlay_")
+            self._owned_dirs.append(self._overlay_dir)
+            self._appends = open(os.path.join(self._overlay_dir, TEXTS_FILE), "a+b")
+        return self._appends
+
+    def _append(self, text, metadata):
+        idx = len(self)
+        data = text.encode("utf-8")
+        self._append_file().write(data)
+        self._offsets_tail.append(self._offset(idx) + len(data))
+
+        metadata = metadata or {}
+        for field in metadata:
+            if field not in self.columns:
+                self.columns[field] = MetadataColumn()
+                self.columns[field].pad(idx)
+        for field, column in self.columns.items():
+            column.append(_normalize_value(metadata.get(field)))
+        return idx
+
+    def _replace_file(self, name, write):
+        # Write next to the target and rename over it: readers that mapped the
+        # old file keep a valid view of the old inode.
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Persist texts, offsets and metadata columns so the store can be reopened"""
+        if self._appends is not None:
+            self._appends.flush()
+        if self._overlay_dir is not None:
+            def write_texts(path):
+                appended = self._offset(len(self)) - self._base_size
+                with open(path, "wb") as f:
+                    if self._blob_map is not None:
+                        f.write(self._blob_map[:self._base_size])
+                    f.write(os.pread(self._appends.fileno(), appended, 0))
+            self._replace_file(TEXTS_FILE, write_texts)
+        offsets = np.concatenate([np.asarray(self._offsets_base), np.frombuffer(self._offsets_tail, dtype=np.int64)])
+        self._replace_file(OFFSETS_FILE, offsets.tofile)
+        kinds = {}
+        for field, column in self.columns.items():
+            self._replace_file(_column_file(field), column.codes().astype(np.int32).tofile)
+            # The value blob and its offsets are written side by side, then both renamed into place
+            values_path = os.path.join(self.directory, _values_file(field))
+            offsets_path = os.path.join(self.directory, _value_offsets_file(field))
+            suffix = f".tmp-{os.getpid()}"
+            kinds[field] = column.values.write(values_path + suffix, offsets_path + suffix)
+            os.replace(values_path + suffix, values_path)
+            os.replace(offsets_path + suffix, offsets_path)
+
+        def write_fields(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"fields": kinds}, f)
+        self._replace_file(METADATA_FILE, write_fields)
+
+    def close(self):
+        if self._blob_map is not None:
+            self._blob_map.close()
+            self._blob_map = None
+        if self._appends is not None:
+            self._appends.close()
+            self._appends = None
+        for column in self.columns.values():
+            column.values.close()
+        self._cleanup()
@@ -0,0 +1,150 @@
+import os
+import time
+import shutil
+import argparse
+import faiss
+import numpy as np
+
+# torch: full-precision PyTorch; onnx: the exported ONNX graph; onnx-int8: ONNX with dynamic int8 quantization
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# avx2 kernels run on any x86-64 server of the last decade; sentence-transformers also knows avx512, avx512_vnni and arm64
+INT8_QUANTIZATION = "avx2"
+# Models without a published int8 graph are quantized once into this directory
+ONNX_EXPORT_DIR = "data/onnx_models"
+
+
+def model_key(model_name, backend="torch"):
+    """Identifies the embeddings a model produces; torch keeps the plain name so existing caches stay valid"""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def _int8_file_name(quantization=INT8_QUANTIZATION):
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def _export_int8(model_name, path, quantization=INT8_QUANTIZATION):
+    """Export the model to ONNX and quantize it into path, written on the side and renamed into place"""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    print(f"[Embeddings] Quantizing {model_name} to int8 ({quantization})...")
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(tmp_path)
+        export_dynamic_quantized_onnx_model(model, quantization, tmp_path)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_model(model_name, backend="torch", device=None):
+    """Load a SentenceTransformer running on the given backend"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device=device, backend="onnx")
+
+    file_name = _int8_file_name()
+    try:
+        # The sentence-transformers models publish quantized graphs next to the weights
+        return SentenceTransformer(model_name, device=device, backend="onnx", model_kwargs={"file_name": file_name})
+    except Exception as e:
+        print(f"[Embeddings] No published {file_name} for {model_name} ({e}), quantizing locally")
+    path = os.path.join(ONNX_EXPORT_DIR, model_name.replace("/", "__"))
+    if not os.path.exists(os.path.join(path, file_name)):
+        _export_int8(model_name, path)
+    return SentenceTransformer(path, device=device, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def _encode(model, texts, batch_size):
+    start = time.perf_counter()
+    vectors = np.ascontiguousarray(model.encode(texts, batch_size=batch_size, show_progress_bar=False),
+                                   dtype=np.float32)
+    seconds = time.perf_counter() - start
+    faiss.normalize_L2(vectors)
+    return vectors, seconds
+
+
+def compare_backends(model_name, corpus, queries, backend="onnx-int8", baseline="torch", k=10, batch_size=32):
+    """Retrieval overlap and speed of backend against baseline on the same corpus and queries.
+
+    overlap_at_k is the mean fraction of each query's top-k passages under the
+    baseline that the backend also returns; cosine is the mean similarity of
+    the two embeddings of each corpus text.
+    """
+    report = {"model": model_name, "backend": backend, "baseline": baseline, "k": k,
+              "num_passages": len(corpus), "num_queries": len(queries)}
+    results = {}
+    for name in (baseline, backend):
+        model = load_model(model_name, name, device="cpu")
+        doc_vectors, doc_seconds = _encode(model, corpus, batch_size)
+        query_vectors, _ = _encode(model, queries, batch_size)
+        # One query at a time, as in serving
+        start = time.perf_counter()
+        for query in queries:
+            model.encode([query], show_progress_bar=False)
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        index = faiss.IndexFlatIP(doc_vectors.shape[1])
+        index.add(doc_vectors)
+        _, indices = index.search(query_vectors, k)
+        results[name] = (doc_vectors, indices)
+        report[f"{name}.passages_per_s"] = len(corpus) / doc_seconds
+        report[f"{name}.query_ms"] = query_ms
+        del model
+
+    base_vectors, base_indices = results[baseline]
+    vectors, indices = results[backend]
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(base_indices.tolist(), indices.tolist())]
+    report["overlap_at_k"] = float(np.mean(overlaps))
+    report["min_overlap_at_k"] = float(np.min(overlaps))
+    report["top1_agreement"] = float(np.mean(base_indices[:, 0] == indices[:, 0]))
+    report["cosine"] = float(np.mean(np.sum(base_vectors * vectors, axis=1)))
+    return report
+
+
+def format_comparison(report):
+    backend, baseline = report["backend"], report["baseline"]
+    return "\n".join([
+        f"{report['model']}: {backend} vs {baseline}, {report['num_passages']} passages, "
+        f"{report['num_queries']} queries",
+        f"overlap@{report['k']:<4} {report['overlap_at_k']:>8.3f}  (min {report['min_overlap_at_k']:.3f})",
+        f"top-1 agreement {report['top1_agreement']:>8.3f}",
+        f"mean cosine     {report['cosine']:>8.4f}",
+        f"{'':<16} {baseline:>10} {backend:>10}",
+        f"{'passages/s':<16} {report[f'{baseline}.passages_per_s']:>10.1f} {report[f'{backend}.passages_per_s']:>10.1f}",
+        f"{'ms/query':<16} {report[f'{baseline}.query_ms']:>10.2f} {report[f'{backend}.query_ms']:>10.2f}",
+    ])
+
+
+if __name__ == "__main__":
+    from tools.retriever_tool import iter_csv_records, preprocess_text
+    from tools.passage_splitter import split_passages
+
+    parser = argparse.ArgumentParser(description="Retrieval overlap of an embedding backend against PyTorch")
+    parser.add_argument("--csv", default="data/mtsamples_surgery.csv")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--num-docs", type=int, default=1000, help="Transcripts to index, 0 for all")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus, queries = [], []
+    for record in iter_csv_records(args.csv):
+        if args.num_docs and len(queries) >= args.num_docs:
+            break
+        text = preprocess_text(record["transcription"])
+        passages = [passage.text for passage in split_passages(text)] or [text]
+        corpus.extend(passages)
+        # The sample descriptions are short, natural-language queries about their transcript
+        queries.append(preprocess_text(record.get("description")) or passages[0][:200])
+    rng = np.random.default_rng(0)
+    queries = [queries[i] for i in rng.choice(len(queries), min(args.num_queries, len(queries)), replace=False)]
+
+    print(format_comparison(compare_backends(args.model, corpus, queries, backend=args.backend, k=args.k)))
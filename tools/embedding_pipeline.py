@@ -0,0 +1,107 @@
+import os
+import multiprocessing as mp
+import numpy as np
+from tools.embedding_backends import load_model
+from tools.embedding_registry import embedding_registry
+
+# Per-process model, loaded once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(model_name, threads_per_worker, backend="torch"):
+    global _worker_model
+    import torch
+
+    # Each worker gets its own slice of cores instead of all of them fighting over every core
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = load_model(model_name, backend, device="cpu")
+
+
+def _encode_shard(shard):
+    positions, texts, batch_size = shard
+    embeddings = _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    return positions, np.asarray(embeddings, dtype=np.float32)
+
+
+def adaptive_batch_size(max_chars, token_budget=16384, min_batch=8, max_batch=256):
+    """Bigger batches for short texts, smaller ones for long texts, at a roughly constant token count"""
+    # ~4 characters per token, capped by the 512-token limit of the models we use
+    tokens = max(1, min(max_chars // 4, 512))
+    return int(max(min_batch, min(max_batch, token_budget // tokens)))
+
+
+def make_buckets(texts, token_budget=16384):
+    """Sort texts by length and cut them into buckets of similar length.
+
+    Returns (positions, batch_size) pairs, where positions index into texts.
+    Texts in a bucket pad to nearly the same length, so little compute is
+    wasted on padding tokens.
+    """
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    buckets = []
+    start = 0
+    while start < len(order):
+        # Lengths only grow along order, so the last text admitted sets the bucket's batch size
+        end = start
+        while end < len(order) and end - start < adaptive_batch_size(len(texts[order[end]]), token_budget):
+            end += 1
+        buckets.append((order[start:end], adaptive_batch_size(len(texts[order[end - 1]]), token_budget)))
+        start = end
+    return buckets
+
+
+class ParallelEncoder:
+    """Encode texts across a pool of CPU worker processes, each holding its own model.
+
+    Texts are bucketed by length, buckets are sharded over the workers, and
+    embeddings come back in the original order.
+    """
+
+    def __init__(self, model_name, num_workers=None, token_budget=16384, backend="torch"):
+        self.model_name = model_name
+        self.backend = backend
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 1) // 2)
+        self.token_budget = token_budget
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+            # spawn: forking a process that already initialised torch can deadlock
+            ctx = mp.get_context("spawn")
+            if self.backend == "onnx-int8":
+                # Quantize once here, otherwise every worker would export its own copy; the
+                # parent needs the model for queries anyway
+                embedding_registry.get(self.model_name, self.backend)
+            self._pool = ctx.Pool(self.num_workers, initializer=_init_worker,
+                                  initargs=(self.model_name, threads, self.backend))
+        return self._pool
+
+    def encode(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        shards = [
+            (positions, [texts[i] for i in positions], batch_size)
+            for positions, batch_size in make_buckets(texts, self.token_budget)
+        ]
+
+        result = None
+        for positions, embeddings in self._get_pool().imap_unordered(_encode_shard, shards):
+            if result is None:
+                result = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+            result[positions] = embeddings
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
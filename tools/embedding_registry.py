@@ -0,0 +1,77 @@
+import threading
+from tools.instrumentation import instrumentation
+from tools.embedding_backends import load_model, model_key
+
+# Output dimensions of the models we ship with, so indexes can be created without loading the model
+KNOWN_DIMENSIONS = {
+    "all-MiniLM-L6-v2": 384,
+    "sentence-transformers/all-MiniLM-L6-v2": 384,
+    "all-mpnet-base-v2": 768,
+    "sentence-transformers/all-mpnet-base-v2": 768,
+}
+
+
+class EmbeddingRegistry:
+    """Process-wide SentenceTransformer models, loaded on first use and shared by all tools.
+
+    Every tool asking for the same model name and backend gets the same
+    instance, so the model is loaded and held in memory once. warm_up()
+    loads models ahead of time, e.g. in the background at startup, so the
+    first query does not pay the load.
+    """
+
+    def __init__(self, device=None):
+        self.device = device
+        self._models = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name, backend="torch"):
+        key = model_key(model_name, backend)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # One lock per model: concurrent first uses wait for a single load, other models load in parallel
+        with load_lock:
+            model = self._models.get(key)
+            if model is None:
+                with instrumentation.span("embedding.load", model=key):
+                    model = load_model(model_name, backend, device=self.device)
+                self._models[key] = model
+                print(f"[Embeddings] Loaded {key}")
+        return model
+
+    def is_loaded(self, model_name, backend="torch"):
+        return model_key(model_name, backend) in self._models
+
+    def loaded(self):
+        return list(self._models)
+
+    def dimension(self, model_name, backend="torch"):
+        """Embedding dimension, without loading the model when it is a known one"""
+        if model_name in KNOWN_DIMENSIONS:
+            return KNOWN_DIMENSIONS[model_name]
+        return self.get(model_name, backend).get_sentence_embedding_dimension()
+
+    def warm_up(self, models, background=False):
+        """Load the (model name, backend) pairs and run one encode so lazy initialisation happens now.
+
+        With background=True this returns the warm-up thread right away.
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, args=(list(models),), name="embedding-warmup",
+                                      daemon=True)
+            thread.start()
+            return thread
+        for model_name, backend in dict.fromkeys(models):
+            try:
+                self.get(model_name, backend).encode(["warm up"], show_progress_bar=False)
+            except Exception as e:
+                print(f"[Embeddings] Warm-up of {model_key(model_name, backend)} failed: {e}")
+        return None
+
+
+# Process-wide instance shared by the retriever and the PDF processor
+embedding_registry = EmbeddingRegistry()
@@ -0,0 +1,186 @@
+import math
+import time
+import argparse
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Index types that must see a sample of vectors before anything can be added
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq")
+
+
+def default_nlist(num_vectors):
+    """Rule of thumb of ~4*sqrt(N) lists, capped so every list gets ~39 training points"""
+    if num_vectors <= 0:
+        return 1
+    nlist = int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // 39))
+
+
+def create_index(index_type, dimension, num_train_vectors=None, nlist=None, pq_m=None, pq_nbits=8,
+                 hnsw_m=32, ef_construction=80):
+    """Create an empty inner-product index of the requested type"""
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    if index_type in TRAINED_INDEX_TYPES:
+        nlist = nlist or default_nlist(num_train_vectors or 0)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+
+        # PQ needs the dimension to split evenly into sub-quantizers
+        pq_m = pq_m or next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if dimension % m == 0)
+        if dimension % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    raise ValueError(f"Unknown index type: {index_type}. Expected one of {INDEX_TYPES}")
+
+
+def train_index(index, vectors, sample_size=50000, seed=0):
+    """Train an index on a random sample of (normalized) vectors"""
+    if index.is_trained:
+        return
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) > sample_size:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    index.train(vectors)
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time knobs: nprobe for IVF indexes, efSearch for HNSW"""
+    if nprobe is not None:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            ivf = None
+        if ivf is not None:
+            ivf.nprobe = min(int(nprobe), ivf.nlist)
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = int(ef_search)
+
+
+def selector_search_params(index, selector):
+    """SearchParameters restricting a search to selector, keeping the index's own nprobe / efSearch"""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    if ivf is not None:
+        # Per-call parameters replace the index settings, so carry nprobe over explicitly
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_memory_bytes(index):
+    """Report the memory taken by an index, split into per-vector codes and total"""
+    try:
+        code_size = faiss.extract_index_ivf(index).code_size
+    except RuntimeError:
+        storage = getattr(index, "storage", index)
+        code_size = getattr(storage, "code_size", index.d * 4)
+    return {
+        "num_vectors": int(index.ntotal),
+        "bytes_per_vector": int(code_size),
+        "codes_bytes": int(index.ntotal * code_size),
+        "total_bytes": int(faiss.serialize_index(index).nbytes),
+    }
+
+
+def _search_settings(index_type, nprobe_values, ef_search_values):
+    if index_type in TRAINED_INDEX_TYPES:
+        return [{"nprobe": n} for n in nprobe_values]
+    if index_type == "hnsw":
+        return [{"ef_search": ef} for ef in ef_search_values]
+    return [{}]
+
+
+def recall_latency_report(index, index_type, reference_index, queries, k=10,
+                          nprobe_values=(1, 4, 16, 64), ef_search_values=(16, 32, 64, 128)):
+    """Measure recall@k against an exact index and mean latency for each search setting"""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    _, truth = reference_index.search(queries, k)
+
+    report = []
+    for params in _search_settings(index_type, nprobe_values, ef_search_values):
+        set_search_params(index, **params)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+
+        hits = sum(len(set(t[t != -1]) & set(f[f != -1])) for t, f in zip(truth, found))
+        report.append({
+            "index_type": index_type,
+            **params,
+            "recall_at_k": hits / float(len(queries) * k),
+            "latency_ms": 1000.0 * elapsed / len(queries),
+        })
+    return report
+
+
+def evaluate_backends(vectors, queries, index_types=INDEX_TYPES, k=10, **index_kwargs):
+    """Build each backend over the same vectors and compare it with the flat index"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+
+    reference = faiss.IndexFlatIP(dimension)
+    reference.add(vectors)
+
+    results = []
+    for index_type in index_types:
+        index = create_index(index_type, dimension, num_train_vectors=len(vectors), **index_kwargs)
+        start = time.perf_counter()
+        train_index(index, vectors)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+
+        memory = index_memory_bytes(index)
+        for row in recall_latency_report(index, index_type, reference, queries, k=k):
+            row.update(memory)
+            row["build_seconds"] = build_seconds
+            results.append(row)
+    return results
+
+
+def format_report(results):
+    lines = [f"{'index':<10} {'setting':<14} {'recall@k':>9} {'ms/query':>9} {'B/vector':>9} {'total MB':>9}"]
+    for row in results:
+        if "nprobe" in row:
+            setting = f"nprobe={row['nprobe']}"
+        elif "ef_search" in row:
+            setting = f"efSearch={row['ef_search']}"
+        else:
+            setting = "exact"
+        lines.append(
+            f"{row['index_type']:<10} {setting:<14} {row['recall_at_k']:>9.3f} {row['latency_ms']:>9.3f} "
+            f"{row['bytes_per_vector']:>9} {row['total_bytes'] / 1e6:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency report of ANN backends against the flat index")
+    parser.add_argument("--index", default="data/index_cache/index.faiss", help="Flat index holding the corpus vectors")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    flat = faiss.read_index(args.index)
+    corpus = flat.reconstruct_n(0, flat.ntotal)
+    rng = np.random.default_rng(0)
+    # Perturbed corpus vectors stand in for queries so no model needs loading
+    sample = corpus[rng.choice(len(corpus), min(args.num_queries, len(corpus)), replace=False)]
+    sample = sample + rng.normal(scale=0.05, size=sample.shape).astype(np.float32)
+    faiss.normalize_L2(sample)
+
+    print(format_report(evaluate_backends(corpus, sample, k=args.k)))
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (0, 1 << 20, 10 << 20, 100 << 20, 1 << 30)
+CHARS_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def current_rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak, so deltas only show growth
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Instrumentation:
+    """Spans, counters and histograms for the agent and its tools.
+
+    Every span records wall time and the RSS change while it was open into
+    Prometheus-style histograms, and is optionally written as one JSON line
+    to a span log. LLM calls additionally record prompt size and token
+    counts. render_prometheus() produces the text exposition format and
+    serve() exposes it over HTTP.
+    """
+
+    def __init__(self, json_log_path=None, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._logger = None
+        if json_log_path:
+            self.set_json_log(json_log_path)
+
+    def set_json_log(self, path):
+        """Write every span and LLM call as a JSON line to path"""
+        logger = logging.getLogger("instrumentation.spans")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        self._logger = logger
+
+    def _log(self, record):
+        if self._logger is not None:
+            record["ts"] = time.time()
+            self._logger.info(json.dumps(record, default=str))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a block; attributes added to the yielded dict end up in the span log"""
+        if not self.enabled:
+            yield attrs
+            return
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            rss_after = current_rss_bytes()
+            self.observe("span_duration_seconds", duration, span=name)
+            self.observe("span_rss_delta_bytes", max(rss_after - rss_before, 0), buckets=BYTES_BUCKETS, span=name)
+            if error:
+                self.inc("span_errors_total", span=name)
+            self._log({"span": name, "duration_ms": duration * 1000, "rss_bytes": rss_after,
+                       "rss_delta_bytes": rss_after - rss_before, "error": error, **attrs})
+
+    def record_llm(self, node, prompt, message):
+        """Record prompt size and token counts of one LLM call, estimated when the provider reports none"""
+        if not self.enabled:
+            return
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        content = getattr(message, "content", "")
+        content = content if isinstance(content, str) else str(content)
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens") or _estimate_tokens(prompt)
+        completion_tokens = usage.get("output_tokens") or _estimate_tokens(content)
+        self.inc("llm_calls_total", node=node)
+        self.inc("llm_prompt_tokens_total", prompt_tokens, node=node)
+        self.inc("llm_completion_tokens_total", completion_tokens, node=node)
+        self.observe("llm_prompt_chars", len(prompt), buckets=CHARS_BUCKETS, node=node)
+        self._log({"event": "llm", "node": node, "prompt_chars": len(prompt), "prompt_tokens": prompt_tokens,
+                   "completion_tokens": completion_tokens, "estimated": not usage})
+
+    def wrap_node(self, name, func):
+        """Wrap a sync graph node so every call runs in a span tagged with the thread id"""
+        @functools.wraps(func)
+        def wrapper(state, *args, **kwargs):
+            with self.span(f"node.{name}", thread_id=state.get("thread_id")):
+                return func(state, *args, **kwargs)
+        return wrapper
+
+    def wrap_async_node(self, name, func):
+        @functools.wraps(func)
+        async def wrapper(state, *args, **kwargs):
+            with self.span(f"node.{name}", thread_id=state.get("thread_id")):
+                return await func(state, *args, **kwargs)
+        return wrapper
+
+    def register_collector(self, collector):
+        """collector() returns (name, type, labels dict, value) samples read at scrape time"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            collectors = list(self._collectors)
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            declare(name, "histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"[Instrumentation] Collector failed: {e}")
+                continue
+            for name, kind, labels, value in samples:
+                declare(name, kind)
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        declare("process_resident_memory_bytes", "gauge")
+        lines.append(f"process_resident_memory_bytes {current_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="127.0.0.1", routes=None):
+        """Serve /metrics from a daemon thread.
+
+        routes maps extra paths to callables returning (status, content_type, body).
+        """
+        routes = dict(routes or {})
+        routes.setdefault("/metrics", lambda: (200, "text/plain; version=0.0.4", self.render_prometheus()))
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = routes.get(self.path.split("?")[0])
+                status, content_type, body = route() if route else (404, "text/plain", "Not found\n")
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the app log
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        return server
+
+
+# Process-wide instance shared by the agent and the tools
+instrumentation = Instrumentation()
@@ -0,0 +1,75 @@
+import re
+from dataclasses import dataclass
+from typing import List
+
+# MTSamples section headers: upper-case words followed by a colon, e.g.
+# "PREOPERATIVE DIAGNOSES:" or "PROCEDURE IN DETAIL:", usually preceded by a
+# comma or period once the transcription has been flattened to one line.
+SECTION_HEADER = re.compile(r"(?:^|(?<=[\s,.;]))([A-Z][A-Z0-9/&()\-]*(?: [A-Z0-9/&()\-]+)*):")
+
+SENTENCE_END = re.compile(r"(?<=[.?!])[\s,]+")
+
+
+@dataclass
+class Passage:
+    text: str
+    section: str
+    start: int
+
+
+def split_sections(text):
+    """Split a transcription into (header, start, end) spans, header is '' for leading text"""
+    matches = [m for m in SECTION_HEADER.finditer(text) if len(m.group(1)) >= 3]
+    spans = []
+    if not matches or matches[0].start() > 0:
+        spans.append(("", 0, matches[0].start() if matches else len(text)))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        spans.append((match.group(1), match.start(), end))
+    return [span for span in spans if text[span[1]:span[2]].strip(" ,.")]
+
+
+def _split_long(text, start, max_chars):
+    """Cut an oversized section at sentence boundaries into pieces of at most max_chars"""
+    pieces = []
+    piece_start = 0
+    last_break = 0
+    for match in SENTENCE_END.finditer(text):
+        if match.end() - piece_start > max_chars and last_break > piece_start:
+            pieces.append((text[piece_start:last_break], start + piece_start))
+            piece_start = last_break
+        last_break = match.end()
+    while len(text) - piece_start > max_chars:
+        cut = last_break if last_break > piece_start and last_break - piece_start <= max_chars else piece_start + max_chars
+        pieces.append((text[piece_start:cut], start + piece_start))
+        piece_start = cut
+    pieces.append((text[piece_start:], start + piece_start))
+    return [(piece.strip(" ,"), offset) for piece, offset in pieces if piece.strip(" ,")]
+
+
+def split_passages(text, max_chars=1000, min_chars=200) -> List[Passage]:
+    """Section-aware passages: short neighbouring sections are merged, long ones split by sentence"""
+    passages = []
+    pending = None
+    for header, start, end in split_sections(text):
+        section_text = text[start:end].strip(" ,")
+        if len(section_text) > max_chars:
+            if pending:
+                passages.append(pending)
+                pending = None
+            for i, (piece, offset) in enumerate(_split_long(section_text, start, max_chars)):
+                if i > 0 and header:
+                    # Keep the heading on continuation pieces so they still read in context
+                    piece = f"{header} (cont.): {piece}"
+                passages.append(Passage(piece, header, offset))
+            continue
+
+        if pending and len(pending.text) + len(section_text) + 1 <= max_chars and len(pending.text) < min_chars:
+            pending = Passage(f"{pending.text} {section_text}", pending.section, pending.start)
+        else:
+            if pending:
+                passages.append(pending)
+            pending = Passage(section_text, header, start)
+    if pending:
+        passages.append(pending)
+    return passages
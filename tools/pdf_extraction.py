@@ -0,0 +1,33 @@
+import os
+import multiprocessing as mp
+from typing import Iterator, Tuple
+from pypdf import PdfReader
+
+
+def _extract_range(task):
+    """Worker: extract pages [start, stop) of a PDF, each worker opens the file itself"""
+    file_path, start, stop = task
+    reader = PdfReader(file_path)
+    return [(number + 1, reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+
+def iter_pages(file_path, num_workers=1, parallel_min_pages=16, pages_per_task=8) -> Iterator[Tuple[int, str]]:
+    """Yield (1-based page number, text) in page order.
+
+    Long PDFs are extracted by a pool of processes working on contiguous page
+    ranges; pages are yielded as soon as their range is done, so callers can
+    process the document without holding all of its text.
+    """
+    reader = PdfReader(file_path)
+    num_pages = len(reader.pages)
+    if num_workers <= 1 or num_pages < parallel_min_pages:
+        for number, page in enumerate(reader.pages):
+            yield number + 1, page.extract_text() or ""
+        return
+
+    tasks = [(file_path, start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+    # spawn, like the embedding pool: forking a process that already initialised torch can deadlock
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(min(num_workers, len(tasks), os.cpu_count() or 1)) as pool:
+        for pages in pool.imap(_extract_range, tasks):
+            yield from pages
@@ -1,82 +1,330 @@
 import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
-from pypdf import PdfReader
+import faiss
+import numpy as np
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from tools.doc_store import DocumentStore
+from tools.embedding_pipeline import ParallelEncoder
+from tools.embedding_registry import embedding_registry
+from tools.embedding_backends import model_key
+from tools.index_backends import selector_search_params
+from tools.pdf_extraction import iter_pages
+from tools.instrumentation import instrumentation
+from tools.query_cache import LRUCache, normalize_query
+
+PDF_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+# Bump whenever extraction or chunking changes so cached PDFs are re-processed
+PDF_PIPELINE_VERSION = 2
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 150
+
+
+def split_pages(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Chunk a stream of (page number, text) pages without joining the whole document.
+
+    Yields (chunk, page, offset): the page the chunk starts on and its
+    character offset in the document (pages joined by newlines). Only a
+    window of the last chunk plus the newest page is held in memory; the last
+    chunk of each window is re-split with the next page since it may continue there.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    page_starts, page_numbers = [], []
+    window, window_start, doc_length = "", 0, 0
+
+    def chunks_of(text):
+        for doc in splitter.create_documents([text]):
+            yield doc.page_content, max(doc.metadata.get("start_index", 0), 0)
+
+    def located(chunk, start):
+        offset = window_start + start
+        return chunk, page_numbers[bisect_right(page_starts, offset) - 1], offset
+
+    for number, text in pages:
+        page_starts.append(doc_length)
+        page_numbers.append(number)
+        text += "\n"
+        doc_length += len(text)
+        window += text
+        if len(window) < 2 * chunk_size:
+            continue
+        chunks = list(chunks_of(window))
+        if not chunks:
+            # Whitespace only, nothing to carry over
+            window_start += len(window)
+            window = ""
+            continue
+        for chunk, start in chunks[:-1]:
+            yield located(chunk, start)
+        last_start = chunks[-1][1]
+        window = window[last_start:]
+        window_start += last_start
+
+    for chunk, start in chunks_of(window):
+        yield located(chunk, start)
+
+
+@dataclass
+class PDFHit:
+    store_id: int
+    score: float
+    source: str
+    text: str
 
 
 class PDFProcessor:
-    def __init__(self, debug: bool = False):
+    def __init__(self, debug: bool = False, store_dir: Optional[str] = None, num_workers: int = 1,
+                 parallel_min_chunks: int = 256, cache_size: int = 1024, cache_ttl: float = 3600.0,
+                 pdf_cache_dir: Optional[str] = "data/pdf_cache", parallel_min_pages: int = 16,
+                 model_name: str = PDF_EMBEDDING_MODEL, embedding_backend: str = "torch"):
         self.debug = debug
-        self.pdf_docs = {}  
-        self.vector_stores = {} 
-        
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-mpnet-base-v2"
-        )
-    
-    def load_pdf(self, file_path: str) -> str:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"PDF file not found at {file_path}")
-        
-        doc_id = os.path.basename(file_path).split('.')[0]
-        
-        text = ""
-        reader = PdfReader(file_path)
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=150
-        )
-        chunks = text_splitter.create_documents([text])
-        
-        for i, chunk in enumerate(chunks):
-            page_num = i // 3  
-            chunk.metadata["source"] = f"{doc_id}_page_{page_num}"
-        
-        self.pdf_docs[doc_id] = chunks
-        
-        vector_store = FAISS.from_documents(chunks, self.embeddings)
-        self.vector_stores[doc_id] = vector_store
-        
+        # Loaded on first use from the process-wide registry, shared with any tool using the same model
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.num_workers = num_workers
+        # Below this many chunks the cost of starting worker processes outweighs the gain
+        self.parallel_min_chunks = parallel_min_chunks
+        self.parallel_min_pages = parallel_min_pages
+        # Chunks of every loaded PDF share one document store and one FAISS
+        # index with the same ids; pdf_docs maps each doc_id to its id range.
+        # doc_ids are content hashes, so loading the same PDF again is a no-op.
+        # Without a store_dir the chunk texts live in a temporary directory removed on close() or exit
+        self.store = DocumentStore(store_dir) if store_dir else DocumentStore.temporary(prefix="pdf_store_")
+        self.pdf_docs = {}
+        self.index = None
+        # Loads are serialized and swap in a new index when complete; searches never lock
+        self._write_lock = threading.Lock()
+        # Bumped on every swap, results computed against an older index are not cached
+        self._generation = 0
+        # Extracted chunks and embeddings per content hash, reused across uploads and restarts
+        self.pdf_cache_dir = pdf_cache_dir
+        self.embedding_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.result_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    @property
+    def model(self):
+        return embedding_registry.get(self.model_name, self.embedding_backend)
+
+    @staticmethod
+    def _normalize(texts: List[str]) -> List[str]:
+        # Newlines become spaces, as the HuggingFaceEmbeddings wrapper used to do, so cached embeddings stay valid
+        return [text.replace("\n", " ") for text in texts]
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, show_progress_bar=False), dtype=np.float32)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        # Before choosing a path, so the serial and parallel encoders embed the same text
+        texts = self._normalize(texts)
+        if self.num_workers > 1 and len(texts) >= self.parallel_min_chunks:
+            with ParallelEncoder(self.model_name, num_workers=self.num_workers,
+                                 backend=self.embedding_backend) as encoder:
+                vectors = encoder.encode(texts)
+        else:
+            vectors = self._encode(texts)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        q_embedding = self.embedding_cache.get(key)
+        if q_embedding is None:
+            with instrumentation.span("pdf.embed_query"):
+                q_embedding = self._encode(self._normalize([query]))
+            faiss.normalize_L2(q_embedding)
+            self.embedding_cache.set(key, q_embedding)
+        return q_embedding
+
+    def close(self):
+        """Release the document store, removing its temporary files"""
+        self.store.close()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {"embeddings": self.embedding_cache.stats(), "results": self.result_cache.stats()}
+
+    def _extract_chunks(self, file_path: str):
+        """Extract and chunk a PDF, returns the chunk texts, their start pages and character offsets"""
+        pages = iter_pages(file_path, num_workers=self.num_workers, parallel_min_pages=self.parallel_min_pages)
+        chunks, page_numbers, offsets = [], [], []
+        for chunk, page, offset in split_pages(pages):
+            chunks.append(chunk)
+            page_numbers.append(page)
+            offsets.append(offset)
+        return chunks, page_numbers, offsets
+
+    def _cache_path(self, content_hash: str) -> str:
+        return os.path.join(self.pdf_cache_dir, content_hash)
+
+    def _read_cache(self, content_hash: str):
+        """Chunks, pages, offsets and embeddings persisted for this content, None if missing or stale"""
+        if not self.pdf_cache_dir:
+            return None
+        path = self._cache_path(content_hash)
+        try:
+            with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("model") != model_key(self.model_name, self.embedding_backend) or cached.get("version") != PDF_PIPELINE_VERSION:
+                return None
+            vectors = np.load(os.path.join(path, "embeddings.npy"))
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(vectors) != len(cached["chunks"]):
+            return None
+        return cached["chunks"], cached["pages"], cached["offsets"], vectors
+
+    def _write_cache(self, content_hash: str, chunks: List[str], pages: List[int], offsets: List[int],
+                     vectors: np.ndarray):
+        if not self.pdf_cache_dir:
+            return
+        path = self._cache_path(content_hash)
+        # Write next to the final directory and rename, so readers never see a partial entry
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+            np.save(os.path.join(tmp_path, "embeddings.npy"), vectors)
+            with open(os.path.join(tmp_path, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({"model": model_key(self.model_name, self.embedding_backend), "version": PDF_PIPELINE_VERSION,
+                           "chunks": chunks, "pages": pages, "offsets": offsets}, f)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache PDF {content_hash}: {e}")
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _load(self, content_hash: str, name: Optional[str], extract, progress=None) -> str:
+        with self._write_lock:
+            return self._load_locked(content_hash, name, extract, progress or (lambda fraction, message="": None))
+
+    def _load_locked(self, content_hash: str, name: Optional[str], extract, progress) -> str:
+        doc_id = content_hash[:16]
+        if doc_id in self.pdf_docs:
+            if self.debug:
+                print(f"PDF {doc_id} is already loaded")
+            return doc_id
+        name = name or f"pdf-{doc_id[:8]}"
+
+        cached = self._read_cache(content_hash)
+        if cached is not None:
+            chunks, pages, offsets, vectors = cached
+        else:
+            progress(0.05, f"Extracting {name}")
+            with instrumentation.span("pdf.extract", pdf=name):
+                chunks, pages, offsets = extract()
+            if not chunks:
+                raise ValueError(f"No extractable text in PDF {name}")
+            progress(0.4, f"Embedding {len(chunks)} chunks")
+            with instrumentation.span("pdf.embed", chunks=len(chunks)):
+                vectors = self._embed(chunks)
+            self._write_cache(content_hash, chunks, pages, offsets, vectors)
+        progress(0.9, "Indexing")
+
+        metadatas = [
+            {"doc_id": doc_id, "source": f"{name}_page_{page}", "page": page, "start_index": offset}
+            for page, offset in zip(pages, offsets)
+        ]
+
+        # Extend a copy and swap it in: searches keep using the old index until this PDF is complete
+        index = faiss.clone_index(self.index) if self.index is not None else faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        start = len(self.store)
+        self.store.extend(chunks, metadatas)
+        self.index = index
+        self.pdf_docs[doc_id] = range(start, len(self.store))
+        self._generation += 1
+        self.result_cache.clear()
+
         if self.debug:
-            print(f"Loaded PDF {doc_id} with {len(chunks)} chunks")
-        
+            origin = "cache" if cached is not None else "extraction"
+            print(f"Loaded PDF {name} ({doc_id}) with {len(chunks)} chunks from {origin}")
+
         return doc_id
-    
+
+    def load_pdf(self, file_path: str, name: Optional[str] = None, progress=None) -> str:
+        """Load a PDF file, returns its doc_id (a prefix of the content hash)"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"PDF file not found at {file_path}")
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        name = name or os.path.splitext(os.path.basename(file_path))[0]
+        return self._load(digest.hexdigest(), name, lambda: self._extract_chunks(file_path), progress)
+
+    def load_pdf_bytes(self, data: bytes, name: Optional[str] = None, progress=None) -> str:
+        """Load an uploaded PDF; a temporary file is only written when the content is not cached"""
+        def extract():
+            fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                return self._extract_chunks(temp_path)
+            finally:
+                os.remove(temp_path)
+
+        return self._load(hashlib.sha256(data).hexdigest(), name, extract, progress)
+
+    def search_hits(self, query: str, doc_id: Optional[str] = None, k: int = 4) -> List[PDFHit]:
+        """Structured search results: store id, cosine score, source label and chunk text.
+
+        All PDFs live in one index, so a search across documents returns the
+        global top-k by score; doc_id restricts it to that PDF's id range.
+        """
+        index, generation = self.index, self._generation
+        if index is None or (doc_id and doc_id not in self.pdf_docs):
+            return []
+
+        cache_key = (normalize_query(query), doc_id, k)
+        scored_ids = self.result_cache.get(cache_key)
+        if scored_ids is None:
+            q_embedding = self._embed_query(query)
+
+            with instrumentation.span("pdf.faiss_search", k=k, doc_id=doc_id):
+                if doc_id:
+                    id_range = self.pdf_docs[doc_id]
+                    selector = faiss.IDSelectorRange(id_range.start, id_range.stop)
+                    params = selector_search_params(index, selector)
+                    scores, indices = index.search(q_embedding, min(k, len(id_range)), params=params)
+                else:
+                    scores, indices = index.search(q_embedding, min(k, index.ntotal))
+
+            scored_ids = [(int(i), float(score)) for score, i in zip(scores[0], indices[0]) if i != -1]
+            if generation == self._generation:
+                self.result_cache.set(cache_key, scored_ids)
+
+        return [
+            PDFHit(store_id, score, self.store.metadata(store_id).get("source", "Unknown"), self.store[store_id].strip())
+            for store_id, score in scored_ids
+        ]
+
     def search(self, query: str, doc_id: Optional[str] = None, k: int = 4) -> str:
         if not self.pdf_docs:
             return "No PDF documents have been loaded yet."
-            
+
         if doc_id and doc_id not in self.pdf_docs:
             return f"Document with ID {doc_id} not found."
-            
-        stores_to_search = [self.vector_stores[doc_id]] if doc_id else list(self.vector_stores.values())
-        
-        all_docs = []
-        for store in stores_to_search:
-            docs = store.similarity_search(query, k=min(k, len(store.index_to_docstore_id)))
-            all_docs.extend(docs)
-        
-        if len(stores_to_search) > 1:
-            all_docs = all_docs[:k]
-        
-        if not all_docs:
+
+        hits = self.search_hits(query, doc_id=doc_id, k=k)
+        if not hits:
             return "No relevant information found in the PDF documents."
-        
+
         results = []
-        for i, doc in enumerate(all_docs):
-            source = doc.metadata.get("source", "Unknown")
-            content = doc.page_content.strip()
-            results.append(f"[PDF-{i+1}] {source}:\n{content}\n")
-        
+        for i, hit in enumerate(hits):
+            results.append(f"[PDF-{i+1}] {hit.source}:\n{hit.text}\n")
+
         formatted_results = "\n".join(results)
-        
+
         if self.debug:
             print(f"PDF search results for query '{query}':")
             print(formatted_results)
-        
-        return formatted_results
\ No newline at end of file
+
+        return formatted_results
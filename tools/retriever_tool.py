@@ -2,145 +2,681 @@ import re
 import faiss
 import numpy as np
 import pandas as pd
-import gc
 import os
+import glob
+import json
 import time
-from sentence_transformers import SentenceTransformer
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from tools.index_backends import TRAINED_INDEX_TYPES, create_index, train_index, set_search_params, selector_search_params
+from tools.doc_store import DocumentStore
+from tools.embedding_pipeline import ParallelEncoder
+from tools.embedding_registry import embedding_registry
+from tools.embedding_backends import model_key
+from tools.query_cache import LRUCache, normalize_query
+from tools.passage_splitter import split_passages
+from tools.bm25 import BM25Index
+from tools.instrumentation import instrumentation
+
+# Bump whenever preprocess_text, the set of indexed columns or the store layout changes so that
+# persisted indexes built with the old pipeline are rebuilt.
+PREPROCESS_VERSION = 5
+
+METADATA_COLUMNS = ['description', 'medical_specialty', 'sample_name', 'keywords']
+
+# Metadata fields accepted by the filters argument of query_batch / query
+FILTER_FIELDS = ("medical_specialty", "sample_name", "keywords")
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def iter_csv_records(path, chunksize=1000):
+    """Stream rows with a transcription from the CSV without loading the whole file"""
+    wanted = set(METADATA_COLUMNS + ['transcription'])
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=lambda column: column in wanted):
+        chunk = chunk.dropna(subset=['transcription'])
+        yield from chunk.to_dict('records')
+
+
+def preprocess_text(text):
+    if not isinstance(text, str):
+        return ""
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'[^\w\s.,?!:;()\[\]{}\-\'"]+', ' ', text)
+    return text
+
+
+def normalize_filter_value(value):
+    return str(value).strip().lower()
+
+
+@dataclass
+class DocumentHit:
+    """A matched transcript: its rank, best passage row and score, metadata and the matching passages.
+
+    Scores are cosine similarities in dense mode, BM25 scores in lexical mode
+    and fused scores in hybrid mode.
+    """
+    rank: int
+    index: int
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    doc_id: int = -1
+    passage_ids: List[int] = field(default_factory=list)
+    passage_scores: List[float] = field(default_factory=list)
+
 
 class DocumentRetriever:
-    def __init__(self, csv_path="data/mtsamples_surgery.csv", top_k=3, similarity_threshold=0.2, batch_size=8):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.dimension = self.model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(self.dimension)
-        self.texts = []
-        self.metadata = []
+    def __init__(self, csv_path="data/mtsamples_surgery.csv", top_k=3, similarity_threshold=0.2, batch_size=32,
+                 model_name='all-MiniLM-L6-v2', cache_dir="data/index_cache", index_type="flat", index_params=None,
+                 train_size=50000, chunk_size=1000, num_workers=1, cache_size=1024, cache_ttl=3600.0,
+                 passage_max_chars=1000, passages_per_doc=2, retrieval_mode="hybrid", fusion="rrf", rrf_k=60,
+                 lexical_weight=0.3, lexical_first=True, lexical_margin=2.0, lexical_min_score=6.0,
+                 embedding_backend="torch"):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        # The model itself is loaded on first encode, from the process-wide registry
+        self.model_name = model_name
+        # "torch", "onnx" or "onnx-int8", see tools/embedding_backends.py
+        self.embedding_backend = embedding_backend
+        self.dimension = embedding_registry.dimension(model_name, embedding_backend)
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        # nprobe / ef_search only affect queries, keep them out of the build parameters
+        self.search_params = {key: self.index_params.pop(key) for key in ("nprobe", "ef_search") if key in self.index_params}
+        self.train_size = train_size
+        self._pending_embeddings = []
+        self.index = self._new_index()
+        self.store = None
+        # BM25 over the same passages, ids match the FAISS and store ids
+        self.bm25 = BM25Index()
+        self.retrieval_mode = retrieval_mode
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.lexical_weight = lexical_weight
+        # Exact-name queries whose BM25 top documents clearly stand out skip query encoding
+        self.lexical_first = lexical_first
+        self.lexical_margin = lexical_margin
+        self.lexical_min_score = lexical_min_score
+        # The index holds section-aware passages; hits are grouped back by doc_id
+        self.passage_max_chars = passage_max_chars
+        self.passages_per_doc = passages_per_doc
+        self._num_docs = 0
+        # Lazily built {field: {value: passage ids}} used for filtered search
+        self._filter_ids = None
         self.top_k = top_k
         self.similarity_threshold = similarity_threshold
         self.batch_size = batch_size
-        self._build_index(csv_path)
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self._encoder = None
+        # Query embeddings only depend on the model; hit lists are cleared whenever the index changes
+        self.embedding_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.result_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache_dir = cache_dir
+        self._index_mmapped = False
+        # Shared flock on the loaded cache's manifest, held until close() so builders leave that directory alone
+        self._cache_reader = None
+        # Writers are serialized; readers never lock and work on the index they picked up
+        self._write_lock = threading.Lock()
+        # Bumped on every index swap, results computed against an older index are not cached
+        self._generation = 0
+
+        fingerprint = self._fingerprint(csv_path)
+        with self._cache_lock(exclusive=False):
+            loaded = self._load_cache(fingerprint)
+        if not loaded:
+            # One worker builds at a time; the others load its cache once they get the lock
+            with self._cache_lock(exclusive=True):
+                if not self._load_cache(fingerprint):
+                    self._build_index(csv_path, fingerprint)
+        set_search_params(self.index, **self.search_params)
+
+    def _new_index(self, num_train_vectors=None):
+        """Empty index for the configured backend, None while a trained backend waits for samples"""
+        if self.index_type in TRAINED_INDEX_TYPES and num_train_vectors is None:
+            return None
+        return create_index(self.index_type, self.dimension, num_train_vectors=num_train_vectors, **self.index_params)
+
+    def _add_embeddings(self, embeddings):
+        """Add normalized embeddings, buffering them until a trained backend has enough samples"""
+        if self.index is not None:
+            self.index.add(embeddings)
+            return
+        self._pending_embeddings.append(embeddings)
+        if sum(len(e) for e in self._pending_embeddings) >= self.train_size:
+            self._train_pending()
+
+    def _train_pending(self):
+        """Create and train the index on the buffered embeddings, then add them"""
+        if self.index is not None or not self._pending_embeddings:
+            return
+        sample = np.concatenate(self._pending_embeddings)
+        self._pending_embeddings = []
+        index = self._new_index(num_train_vectors=len(sample))
+        print(f"Training {self.index_type} index on {len(sample)} vectors...")
+        train_index(index, sample, sample_size=self.train_size)
+        index.add(sample)
+        set_search_params(index, **self.search_params)
+        self.index = index
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Tune the recall/latency trade-off of approximate indexes at query time"""
+        if nprobe is not None:
+            self.search_params["nprobe"] = nprobe
+        if ef_search is not None:
+            self.search_params["ef_search"] = ef_search
+        if self.index is not None:
+            set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+        self.result_cache.clear()
+
+    def _fingerprint(self, path):
+        """Hash of the CSV content plus everything that affects the embeddings"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(f"|model={model_key(self.model_name, self.embedding_backend)}|preprocess={PREPROCESS_VERSION}".encode("utf-8"))
+        digest.update(f"|passage_max_chars={self.passage_max_chars}".encode("utf-8"))
+        digest.update(f"|index={self.index_type}|{json.dumps(self.index_params, sort_keys=True)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    @contextmanager
+    def _cache_lock(self, exclusive):
+        """flock on a file next to the cache: shared while loading it, exclusive while building and swapping it"""
+        if not self.cache_dir:
+            yield
+            return
+        lock_path = f"{self.cache_dir.rstrip(os.sep)}.lock"
+        os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _hold_cache(self):
+        """Mark the cache directory as in use by this process until close()"""
+        self._release_cache()
+        self._cache_reader = open(os.path.join(self.cache_dir, "manifest.json"), "rb")
+        fcntl.flock(self._cache_reader, fcntl.LOCK_SH)
+
+    def _release_cache(self):
+        if self._cache_reader is not None:
+            self._cache_reader.close()
+            self._cache_reader = None
+
+    def _remove_unused_caches(self):
+        """Delete replaced cache directories that no process holds any more"""
+        for old_dir in glob.glob(f"{glob.escape(self.cache_dir.rstrip(os.sep))}.old-*"):
+            try:
+                with open(os.path.join(old_dir, "manifest.json"), "rb") as manifest:
+                    fcntl.flock(manifest, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still served by a worker that loaded it; a later build collects it
+                continue
+            except OSError:
+                pass
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _load_cache(self, fingerprint):
+        """Load a persisted index if its fingerprint matches, returns True on success"""
+        if not self.cache_dir:
+            return False
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return False
+
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("fingerprint") != fingerprint:
+                print("Index cache is stale, rebuilding...")
+                return False
+
+            index_path = os.path.join(self.cache_dir, "index.faiss")
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+                mmapped = True
+            except RuntimeError:
+                # Older faiss builds cannot memory-map flat indexes
+                index = faiss.read_index(index_path)
+                mmapped = False
+
+            store = DocumentStore(self.cache_dir)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"Could not load index cache: {e}")
+            return False
+
+        if index.ntotal != len(store) or index.d != self.dimension:
+            print("Index cache is inconsistent, rebuilding...")
+            store.close()
+            return False
+
+        try:
+            bm25 = BM25Index.load(self.cache_dir)
+        except (OSError, ValueError, KeyError):
+            bm25 = None
+        if bm25 is None or len(bm25) != len(store):
+            # Cache written without a lexical index, rebuild it from the stored passages
+            bm25 = BM25Index()
+            bm25.add(store[i] for i in range(len(store)))
+
+        self.index = index
+        self._index_mmapped = mmapped
+        self.store = store
+        self.bm25 = bm25
+        self._num_docs = len(store.columns["doc_id"].values) if "doc_id" in store.columns else 0
+        self._hold_cache()
+        print(f"Loaded cached index with {self._num_docs} documents ({len(self.store)} passages) from {self.cache_dir}")
+        return True
+
+    def _save_cache(self, fingerprint):
+        """Persist the index and document store next to a manifest holding the fingerprint"""
+        # The store was built in a sibling directory; finish it there and swap
+        # it in, so a crash mid-write never leaves a manifest pointing at partial files.
+        tmp_dir = self.store.directory
+        self.store.flush()
+        self.store.close()
+
+        faiss.write_index(self.index, os.path.join(tmp_dir, "index.faiss"))
+        self.bm25.save(tmp_dir)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "fingerprint": fingerprint,
+                "model_name": self.model_name,
+                "embedding_backend": self.embedding_backend,
+                "index_type": self.index_type,
+                "index_params": self.index_params,
+                "preprocess_version": PREPROCESS_VERSION,
+                "num_documents": len(self.store),
+                "dimension": self.dimension,
+                "created_at": time.time(),
+            }, f, indent=2)
+
+        # Only the holder of the exclusive cache lock gets here. The old cache is moved aside rather
+        # than deleted: workers that loaded it keep reading it until they close their retriever.
+        if os.path.exists(self.cache_dir):
+            os.replace(self.cache_dir, f"{self.cache_dir.rstrip(os.sep)}.old-{os.getpid()}-{time.time_ns()}")
+        os.replace(tmp_dir, self.cache_dir)
+        self._remove_unused_caches()
+        self.store = DocumentStore(self.cache_dir)
+        self._hold_cache()
+        print(f"Saved index cache to {self.cache_dir}")
 
     def _preprocess_text(self, text):
-        if not isinstance(text, str):
-            return ""
-        text = re.sub(r'\s+', ' ', text).strip()
-        text = re.sub(r'[^\w\s.,?!:;()\[\]{}\-\'"]+', ' ', text)
-        return text
-
-    def _build_index(self, path):
-        gc.collect()
-        
-        print(f"Loading CSV from {path}...")
-        df = pd.read_csv(path)
-        
-        print(f"Loaded {len(df)} rows")
-        
-        print("Filtering and preprocessing texts...")
-        df = df.dropna(subset=['transcription'])
-        
-        self.metadata = df[['medical_specialty', 'sample_name']].to_dict('records')
-        
-        self.texts = []
-        for i in range(0, len(df), self.batch_size):
-            batch = df['transcription'].iloc[i:i+self.batch_size].tolist()
-            self.texts.extend([self._preprocess_text(text) for text in batch])
-            gc.collect()
-        
-        print(f"Preprocessing complete. Starting encoding {len(self.texts)} documents...")
-        
-        for i in range(0, len(self.texts), self.batch_size):
-            end_idx = min(i + self.batch_size, len(self.texts))
-            batch = self.texts[i:end_idx]
-            
-            print(f"Encoding batch {i//self.batch_size + 1}/{(len(self.texts) + self.batch_size - 1)//self.batch_size}...")
-            
-            batch_embeddings = self.model.encode(batch, show_progress_bar=False)
-            
-            faiss.normalize_L2(batch_embeddings)
-            
-            self.index.add(np.array(batch_embeddings))
-            
-            del batch_embeddings
-            gc.collect()
-            
-            time.sleep(0.1)
-        
-        print(f"Index built with {len(self.texts)} documents")
-
-    def add_documents(self, new_texts, new_metadata=None):
+        return preprocess_text(text)
+
+    @property
+    def model(self):
+        return embedding_registry.get(self.model_name, self.embedding_backend)
+
+    def _build_index(self, path, fingerprint):
+        if self.cache_dir:
+            # Per process, so workers building at the same time do not write into each other's files
+            build_dir = f"{self.cache_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+            shutil.rmtree(build_dir, ignore_errors=True)
+            self.store = DocumentStore(build_dir)
+        else:
+            self.store = DocumentStore.temporary(prefix="doc_store_")
+
+        print(f"Streaming CSV from {path} in chunks of {self.chunk_size} rows...")
+        if self.num_workers > 1:
+            self._encoder = ParallelEncoder(self.model_name, num_workers=self.num_workers, backend=self.embedding_backend)
+        try:
+            self.ingest(iter_csv_records(path, chunksize=self.chunk_size))
+            print(f"Index built with {len(self.store)} documents")
+            if self.cache_dir:
+                self._save_cache(fingerprint)
+        except BaseException:
+            # A failed build must not leave its half-written directory behind
+            self.store.close()
+            if self.cache_dir:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        finally:
+            if self._encoder is not None:
+                self._encoder.close()
+                self._encoder = None
+
+    def ingest(self, records):
+        """Preprocess, store and index an iterable of records chunk by chunk.
+
+        Each record is a dict with a 'transcription' and optional metadata
+        columns; peak memory is bounded by chunk_size, not by the corpus.
+        """
+        total = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                total += self._ingest_chunk(chunk)
+                chunk = []
+        if chunk:
+            total += self._ingest_chunk(chunk)
+        self._train_pending()
+        return total
+
+    def _ingest_chunk(self, records):
+        texts = [self._preprocess_text(record.get('transcription')) for record in records]
+        metadatas = [{column: record.get(column) for column in METADATA_COLUMNS if column in record} for record in records]
+        self._add_embeddings(self._store_and_encode(texts, metadatas))
+        print(f"Indexed {self._num_docs} documents...")
+        return len(texts)
+
+    def _store_and_encode(self, texts, metadatas):
+        """Split documents into passages, store them with their parent doc_id and return their embeddings.
+
+        The caller adds the embeddings to a vector index, passage ids follow store order.
+        """
+        passage_texts, passage_metadatas = [], []
+        for text, meta in zip(texts, metadatas):
+            doc_id = self._num_docs
+            self._num_docs += 1
+            for passage in split_passages(text, max_chars=self.passage_max_chars) or [None]:
+                passage_texts.append(passage.text if passage else text)
+                passage_metadatas.append({**(meta or {}), "doc_id": doc_id, "section": passage.section if passage else ""})
+        texts = passage_texts
+        self.store.extend(texts, passage_metadatas)
+        self.bm25.add(texts)
+        if self._encoder is not None:
+            embeddings = self._encoder.encode(texts)
+        else:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def add_documents(self, new_texts, new_metadata=None, progress=None):
+        """Add documents to the live index.
+
+        The updated index is built on the side and swapped in once complete,
+        so queries running meanwhile keep searching the previous index and
+        never see half-added documents. new_metadata, when given, holds one
+        dict per text. progress(fraction, message) is called after every chunk.
+        """
         if not new_texts:
             return
-            
-        processed_texts = [self._preprocess_text(text) for text in new_texts]
-        
-        # Add to existing texts and metadata
-        self.texts.extend(processed_texts)
-        if new_metadata:
-            self.metadata.extend(new_metadata)
-        
-        for i in range(0, len(processed_texts), self.batch_size):
-            batch = processed_texts[i:i+min(self.batch_size, len(processed_texts)-i)]
-            batch_embeddings = self.model.encode(batch, show_progress_bar=False)
-            faiss.normalize_L2(batch_embeddings)
-            self.index.add(np.array(batch_embeddings))
-
-    # def query(self, question, include_metadata=True):
-    #     try:
-    #         q_embedding = self.model.encode([question])
-    #         faiss.normalize_L2(q_embedding)
-            
-    #         k = min(self.top_k * 2, len(self.texts))
-    #         scores, indices = self.index.search(np.array(q_embedding), k)
-            
-    #         results = []
-    #         for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-    #             if idx != -1 and score >= self.similarity_threshold and i < self.top_k:
-    #                 doc_text = self.texts[idx]
-                    
-    #                 if include_metadata and idx < len(self.metadata):
-    #                     meta = self.metadata[idx]
-    #                     doc_info = f"[Document {i+1}] (Score: {score:.2f}, Specialty: {meta.get('medical_specialty', 'Unknown')}, Sample: {meta.get('sample_name', 'Unknown')})\n\n{doc_text}"
-    #                 else:
-    #                     doc_info = f"[Document {i+1}] (Score: {score:.2f})\n\n{doc_text}"
-                    
-    #                 results.append(doc_info)
-            
-    #         gc.collect()
-            
-    #         if not results:
-    #             return "No relevant documents found for this query."
-            
-    #         return "\n\n" + "-"*80 + "\n\n".join(results)
-    #     except Exception as e:
-    #         return f"Error during retrieval: {str(e)}"
-    
-    def query(self, question, include_metadata=True):
+        if new_metadata is not None and len(new_metadata) != len(new_texts):
+            raise ValueError(f"Got {len(new_metadata)} metadata entries for {len(new_texts)} texts")
+
+        with self._write_lock:
+            if self._index_mmapped:
+                # A memory-mapped index is read-only, load a private copy to extend
+                index = faiss.read_index(os.path.join(self.cache_dir, "index.faiss"))
+                set_search_params(index, **self.search_params)
+            elif self.index is not None:
+                index = faiss.clone_index(self.index)
+                set_search_params(index, **self.search_params)
+            else:
+                index = None
+
+            processed_texts = [self._preprocess_text(text) for text in new_texts]
+            new_metadata = new_metadata or [{} for _ in processed_texts]
+            for i in range(0, len(processed_texts), self.chunk_size):
+                embeddings = self._store_and_encode(processed_texts[i:i+self.chunk_size], new_metadata[i:i+self.chunk_size])
+                if index is not None:
+                    index.add(embeddings)
+                else:
+                    # Trained backend still collecting samples, nothing is searchable yet anyway
+                    self._add_embeddings(embeddings)
+                if progress is not None:
+                    done = min(i + self.chunk_size, len(processed_texts))
+                    progress(done / len(processed_texts), f"Indexed {done}/{len(processed_texts)} documents")
+
+            if index is not None:
+                self.index = index
+                self._index_mmapped = False
+            else:
+                self._train_pending()
+            self._filter_ids = None
+            self._generation += 1
+            self.result_cache.clear()
+
+    def close(self):
+        """Release the document store, removing its temporary files"""
+        if self.store is not None:
+            self.store.close()
+        self._release_cache()
+
+    def _doc_id(self, idx):
+        return self.store.columns["doc_id"].value(idx)
+
+    def _filter_index(self):
+        """Per-field inverted id sets, grouped from the dictionary-encoded store columns"""
+        if self._filter_ids is not None:
+            return self._filter_ids
+        filter_ids = {}
+        for name in FILTER_FIELDS:
+            column = self.store.columns.get(name)
+            postings = {}
+            codes = column.codes() if column is not None else np.zeros(0, dtype=np.int32)
+            if len(codes):
+                order = np.argsort(codes, kind="stable")
+                bounds = np.flatnonzero(np.diff(codes[order])) + 1
+                for group in np.split(order, bounds):
+                    code = int(codes[group[0]])
+                    if code < 0:
+                        continue
+                    value = column.values[code]
+                    # keywords hold a comma-separated list, each entry is a filter value of its own
+                    for key in (value.split(",") if name == "keywords" else [value]):
+                        key = normalize_filter_value(key)
+                        if key:
+                            postings.setdefault(key, []).append(group)
+            filter_ids[name] = {key: np.unique(np.concatenate(groups)) for key, groups in postings.items()}
+        self._filter_ids = filter_ids
+        return filter_ids
+
+    def filter_values(self, field):
+        """Known values of a filter field, e.g. to offer them in a UI"""
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter on {field}, expected one of {FILTER_FIELDS}")
+        return sorted(self._filter_index()[field])
+
+    def _filter_mask(self, filters, num_passages):
+        """Boolean mask over the first num_passages passages matching every filtered field.
+
+        A list of values matches any of them.
+        """
+        filter_ids = self._filter_index()
+        mask = np.ones(num_passages, dtype=bool)
+        for name, values in filters.items():
+            if name not in FILTER_FIELDS:
+                raise ValueError(f"Cannot filter on {name}, expected one of {FILTER_FIELDS}")
+            if isinstance(values, str):
+                values = [values]
+            field_mask = np.zeros(num_passages, dtype=bool)
+            for value in values:
+                ids = filter_ids[name].get(normalize_filter_value(value))
+                if ids is not None:
+                    field_mask[ids[ids < num_passages]] = True
+            mask &= field_mask
+        return mask
+
+    def _lexical_confident(self, lexical, top_k):
+        """True when the best BM25 document clearly beats the first one that would not make the top_k"""
+        doc_scores, seen = [], set()
+        for idx, score in lexical:
+            doc_id = self._doc_id(idx)
+            if doc_id not in seen:
+                seen.add(doc_id)
+                doc_scores.append(score)
+        if not doc_scores or doc_scores[0] < self.lexical_min_score:
+            return False
+        runner_up = doc_scores[top_k] if len(doc_scores) > top_k else 0.0
+        return doc_scores[0] >= self.lexical_margin * runner_up
+
+    def _fuse(self, dense, lexical):
+        """Combine two best-first (passage id, score) lists into one"""
+        fused = {}
+        if self.fusion == "rrf":
+            for ranked in (dense, lexical):
+                for rank, (idx, _) in enumerate(ranked):
+                    fused[idx] = fused.get(idx, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        else:
+            # BM25 scores are unbounded, scale them by the best one so they mix with cosine similarities
+            top = lexical[0][1] if lexical else 1.0
+            for idx, score in dense:
+                fused[idx] = (1 - self.lexical_weight) * score
+            for idx, score in lexical:
+                fused[idx] = fused.get(idx, 0.0) + self.lexical_weight * score / top
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+    def _group_passages(self, ranked, top_k):
+        """Aggregate best-first passages into at most top_k DocumentHits.
+
+        The first passage seen for a transcript is its best one, so
+        transcripts come out in score order.
+        """
+        docs = {}
+        for idx, score in ranked:
+            meta = self.store.metadata(idx)
+            doc_id = meta.pop("doc_id", idx)
+            hit = docs.get(doc_id)
+            if hit is None:
+                if len(docs) < top_k:
+                    docs[doc_id] = DocumentHit(rank=len(docs), index=idx, score=score, metadata=meta, doc_id=doc_id,
+                                               passage_ids=[idx], passage_scores=[score])
+            elif len(hit.passage_ids) < self.passages_per_doc:
+                hit.passage_ids.append(idx)
+                hit.passage_scores.append(score)
+        return list(docs.values())
+
+    def query_batch(self, questions, top_k=None, mode=None, filters=None):
+        """Search for several questions at once, returns one list of DocumentHit per question.
+
+        filters maps fields in FILTER_FIELDS to a value or list of values, e.g.
+        {"keywords": "bunionectomy"}; values are matched case-insensitively.
+        Filters are applied inside the search, so narrow filters still return
+        their best matches instead of whatever survives a global top-k.
+        """
+        if not questions:
+            return []
+        top_k = top_k or self.top_k
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        # Everything below works on this snapshot: passages added later are not visible
+        # to this query, even in BM25, until add_documents swaps in the index holding them.
+        index, generation = self.index, self._generation
+        num_passages = index.ntotal if index is not None else len(self.store)
+        # Several passages can belong to one transcript, search deep enough to find top_k distinct ones
+        k = min(top_k * max(2, 2 * self.passages_per_doc), num_passages)
+        allowed = None
+        if filters:
+            allowed = self._filter_mask(filters, num_passages)
+            k = min(k, int(allowed.sum()))
+        if k == 0:
+            return [[] for _ in questions]
+
+        filter_key = json.dumps(filters, sort_keys=True) if filters else None
+        keys = [(normalize_query(question), top_k, mode, filter_key) for question in questions]
+        hits = [self.result_cache.get(key) for key in keys]
+        pending = [row for row, cached in enumerate(hits) if cached is None]
+        if not pending:
+            return hits
+
+        ranked = {}
+        lexical = {}
+        if mode != "dense":
+            with instrumentation.span("retriever.bm25_search", queries=len(pending)):
+                lexical = {row: self.bm25.search(questions[row], k, allowed=allowed, limit=num_passages)
+                           for row in pending}
+            for row in pending:
+                if mode == "lexical":
+                    ranked[row] = lexical[row]
+                elif self.lexical_first and self._lexical_confident(lexical[row], top_k):
+                    # Keep the hybrid score scale even though the dense side was skipped
+                    ranked[row] = self._fuse([], lexical[row])
+
+        dense_rows = [row for row in pending if row not in ranked]
+        if dense_rows:
+            q_embeddings = self.encode_queries([questions[row] for row in dense_rows])
+            with instrumentation.span("retriever.faiss_search", queries=len(dense_rows), k=k, filtered=allowed is not None):
+                if allowed is None:
+                    scores, indices = index.search(q_embeddings, k)
+                else:
+                    # FAISS only visits passages whose bit is set; the bitmap must outlive the search
+                    bitmap = np.packbits(allowed, bitorder="little")
+                    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+                    scores, indices = index.search(q_embeddings, k, params=selector_search_params(index, selector))
+            keep = (indices != -1) & (scores >= self.similarity_threshold)
+            for i, row in enumerate(dense_rows):
+                dense = [(int(idx), float(score)) for idx, score in zip(indices[i][keep[i]], scores[i][keep[i]])]
+                if mode == "hybrid":
+                    # Fusion scores every BM25 hit, off-topic ones included: only fuse when a passage
+                    # passed the similarity threshold, so off-topic queries still find nothing
+                    ranked[row] = self._fuse(dense, lexical[row]) if dense else []
+                else:
+                    ranked[row] = dense
+
+        for row in pending:
+            row_hits = self._group_passages(ranked[row], top_k)
+            if generation == self._generation:
+                self.result_cache.set(keys[row], row_hits)
+            hits[row] = row_hits
+        return hits
+
+    def encode_queries(self, questions):
+        """Normalized query embeddings, served from the embedding cache where possible"""
+        keys = [normalize_query(question) for question in questions]
+        vectors = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with instrumentation.span("retriever.encode_queries", queries=len(missing),
+                                      cache_hits=len(questions) - len(missing)):
+                encoded = self.model.encode([questions[i] for i in missing], batch_size=max(self.batch_size, 32),
+                                            show_progress_bar=False)
+            encoded = np.ascontiguousarray(encoded, dtype=np.float32)
+            faiss.normalize_L2(encoded)
+            for i, vector in zip(missing, encoded):
+                self.embedding_cache.set(keys[i], vector)
+                vectors[i] = vector
+        return np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+
+    def cache_stats(self):
+        return {"embeddings": self.embedding_cache.stats(), "results": self.result_cache.stats()}
+
+    def format_hits(self, hits, include_metadata=True):
+        """Render hits from query_batch in the text format used in prompts"""
+        results = []
+        for hit in hits:
+            doc_text = " ... ".join(self.store[idx] for idx in hit.passage_ids or [hit.index])
+
+            if include_metadata and hit.metadata:
+                meta = hit.metadata
+                description = meta.get('description', 'No description available')
+                doc_info = f"[Document {hit.rank+1}] (Score: {hit.score:.2f})\nSpecialty: {meta.get('medical_specialty', 'Unknown')}\nSample: {meta.get('sample_name', 'Unknown')}\nDescription: {description}\n\n{doc_text}"
+            else:
+                doc_info = f"[Document {hit.rank+1}] (Score: {hit.score:.2f})\n\n{doc_text}"
+
+            results.append(doc_info)
+
+        if not results:
+            return "No relevant documents found for this query."
+
+        return "\n\n" + "-"*80 + "\n\n".join(results)
+
+    def hit_passages(self, hit):
+        """(section, text, score) for each matching passage of a hit, best first"""
+        return [
+            (self.store.metadata(idx).get("section", ""), self.store[idx], score)
+            for idx, score in zip(hit.passage_ids or [hit.index], hit.passage_scores or [hit.score])
+        ]
+
+    def query(self, question, include_metadata=True, filters=None):
         try:
-            q_embedding = self.model.encode([question])
-            faiss.normalize_L2(q_embedding)
-            
-            k = min(self.top_k * 2, len(self.texts))
-            scores, indices = self.index.search(np.array(q_embedding), k)
-            
-            results = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if idx != -1 and score >= self.similarity_threshold and i < self.top_k:
-                    doc_text = self.texts[idx]
-                    
-                    if include_metadata and idx < len(self.metadata):
-                        meta = self.metadata[idx]
-                        # Add description to the output
-                        description = meta.get('description', 'No description available')
-                        doc_info = f"[Document {i+1}] (Score: {score:.2f})\nSpecialty: {meta.get('medical_specialty', 'Unknown')}\nSample: {meta.get('sample_name', 'Unknown')}\nDescription: {description}\n\n{doc_text}"
-                    else:
-                        doc_info = f"[Document {i+1}] (Score: {score:.2f})\n\n{doc_text}"
-                    
-                    results.append(doc_info)
-            
-            gc.collect()
-            
-            if not results:
-                return "No relevant documents found for this query."
-            
-            return "\n\n" + "-"*80 + "\n\n".join(results)
+            hits = self.query_batch([question], filters=filters)[0]
+            return self.format_hits(hits, include_metadata=include_metadata)
         except Exception as e:
-            return f"Error during retrieval: {str(e)}"
\ No newline at end of file
+            return f"Error during retrieval: {str(e)}"
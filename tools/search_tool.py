@@ -1,27 +1,206 @@
-from duckduckgo_search import DDGS
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional
+
+from tools.query_cache import normalize_query
+
+
+class SearchProvider(ABC):
+    """A web search backend returning dicts with 'title', 'href' and 'body'"""
+
+    name = "base"
+
+    @abstractmethod
+    def search(self, query: str, max_results: int = 3) -> List[Dict[str, str]]:
+        ...
+
+
+class DuckDuckGoProvider(SearchProvider):
+    name = "duckduckgo"
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        # One DDGS session per thread: sessions keep their HTTP connection
+        # pool between calls but are not safe to share across threads.
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            from duckduckgo_search import DDGS
+            session = DDGS(timeout=int(self.timeout) or 1)
+            self._local.session = session
+        return session
+
+    def search(self, query: str, max_results: int = 3) -> List[Dict[str, str]]:
+        try:
+            return list(self._session().text(query, max_results=max_results) or [])
+        except Exception:
+            # Drop a session that may be in a bad state, the next call opens a fresh one
+            self._local.session = None
+            raise
+
+
+class OfflineProvider(SearchProvider):
+    """Deterministic local stand-in for tests and offline runs"""
+
+    name = "offline"
+
+    def __init__(self, results: Optional[Dict[str, List[Dict[str, str]]]] = None, delay: float = 0.0):
+        self.results = {normalize_query(query): hits for query, hits in (results or {}).items()}
+        self.delay = delay
+
+    def search(self, query: str, max_results: int = 3) -> List[Dict[str, str]]:
+        if self.delay:
+            time.sleep(self.delay)
+        hits = self.results.get(normalize_query(query))
+        if hits is None:
+            hits = [{
+                "title": f"Offline result for {query}",
+                "href": "offline://search",
+                "body": f"No live web access; placeholder result for '{query}'.",
+            }]
+        return hits[:max_results]
+
+
+class SearchResultCache:
+    """SQLite-backed cache of provider results with a time-to-live, overridable per entry"""
+
+    def __init__(self, path: str = "data/web_cache.sqlite", ttl: float = 24 * 3600):
+        self.ttl = ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS web_results (key TEXT PRIMARY KEY, results TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # Entries with their own TTL store it here; caches created before it existed gain the column
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(web_results)")]
+        if "ttl" not in columns:
+            self._conn.execute("ALTER TABLE web_results ADD COLUMN ttl REAL")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            row = self._conn.execute("SELECT results, created, ttl FROM web_results WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > (row[2] if row[2] is not None else self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, results: List[Dict[str, str]], ttl: Optional[float] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO web_results (key, results, created, ttl) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(results), time.time(), ttl),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM web_results WHERE created + COALESCE(ttl, ?) < ?",
+                               (self.ttl, time.time()))
+            self._conn.commit()
 
 
 class WebSearchTool:
-    
-    def __init__(self, debug=False):
+
+    def __init__(self, debug=False, providers=None, cache_path="data/web_cache.sqlite", cache_ttl=24 * 3600,
+                 timeout=4.0, mode="first", partial_cache_ttl=300):
+        if mode not in ("first", "merge"):
+            raise ValueError(f"Unknown search mode: {mode}")
         self.debug = debug
+        self.providers = providers or [DuckDuckGoProvider(timeout=timeout)]
+        self.cache = SearchResultCache(cache_path, ttl=cache_ttl) if cache_path else None
+        # Merged results missing a provider (deadline or error) are only cached this long
+        self.partial_cache_ttl = partial_cache_ttl
+        self.timeout = timeout
+        self.mode = mode
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.providers), thread_name_prefix="web-search")
 
-    def search_duckduckgo(self, query, max_results=3):
+    @staticmethod
+    def _format_results(results):
+        if not results:
+            return "No relevant information found."
+        return "\n\n".join(
+            f"Title: {r.get('title', 'No title')}\nSource: {r.get('href', 'No source')}\n{r.get('body', '')}"
+            for r in results
+        )
 
-        results = []
+    def search_duckduckgo(self, query, max_results=3):
+        provider = next((p for p in self.providers if isinstance(p, DuckDuckGoProvider)), None) or DuckDuckGoProvider()
         try:
-            with DDGS() as ddgs:
-                for r in ddgs.text(query, max_results=max_results):
-                    results.append(f"Title: {r.get('title', 'No title')}\nSource: {r.get('href', 'No source')}\n{r['body']}")
-            if results:
-                return "\n\n".join(results)
-            else:
-                return "No relevant information found."
+            return self._format_results(provider.search(query, max_results))
         except Exception as e:
             return f"Search error: {str(e)}"
-    
+
+    def _merge(self, result_lists, max_results):
+        """Interleave provider results, dropping duplicate links"""
+        merged, seen = [], set()
+        for rank in range(max(len(results) for results in result_lists)):
+            for results in result_lists:
+                if rank < len(results):
+                    href = results[rank].get("href")
+                    if href not in seen:
+                        seen.add(href)
+                        merged.append(results[rank])
+        return merged[:max_results]
+
+    def search_results(self, query, max_results=3):
+        """Query all providers concurrently within the deadline, returns raw result dicts"""
+        key = f"{normalize_query(query)}|{max_results}|{self.mode}"
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if self.debug:
+                    print(f"[Web Search] Cache hit for: {query}")
+                return cached
+
+        futures = {self._executor.submit(p.search, query, max_results): p for p in self.providers}
+        deadline = time.monotonic() + self.timeout
+        collected, errors = [], []
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future].name}: {e}")
+                    continue
+                if results:
+                    collected.append(results)
+            if collected and self.mode == "first":
+                break
+
+        # Providers still running past the deadline are left to finish in the background
+        if self.debug and pending:
+            print(f"[Web Search] {len(pending)} provider(s) missed the {self.timeout}s deadline")
+        if not collected:
+            if errors:
+                raise RuntimeError("; ".join(errors))
+            return []
+
+        results = collected[0][:max_results] if self.mode == "first" else self._merge(collected, max_results)
+        if self.cache is not None:
+            # In first mode one answer is complete by design; a merge without every provider is not
+            partial = self.mode == "merge" and (pending or errors)
+            self.cache.set(key, results, ttl=self.partial_cache_ttl if partial else None)
+        return results
+
     def search(self, query, max_results=3):
         """Interface method that matches the expected API in agent.py"""
         if self.debug:
             print(f"Searching for: {query}")
-        return self.search_duckduckgo(query, max_results)
\ No newline at end of file
+        try:
+            return self._format_results(self.search_results(query, max_results))
+        except Exception as e:
+            return f"Search error: {str(e)}"